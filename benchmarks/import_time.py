@@ -0,0 +1,89 @@
+"""Cold-start benchmark for the chat graph entry point.
+
+Imports logs_langchain.app in fresh interpreters, without GOOGLE_API_KEY, and
+fails if the best of several runs exceeds the budget. The slowest modules
+reported by -X importtime are printed to show where the time goes.
+
+    python benchmarks/import_time.py
+    IMPORT_TIME_BUDGET=2.5 IMPORT_TIME_RUNS=10 python benchmarks/import_time.py
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+MODULE = os.getenv("IMPORT_TIME_MODULE", "logs_langchain.app")
+BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", "4.0"))
+RUNS = int(os.getenv("IMPORT_TIME_RUNS", "5"))
+TOP = 15
+
+
+def child_env():
+    env = dict(os.environ)
+    # Importing must not need credentials; clients are built on first use.
+    env.pop("GOOGLE_API_KEY", None)
+    src = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+    env["PYTHONPATH"] = os.pathsep.join(
+        path for path in (os.path.abspath(src), env.get("PYTHONPATH")) if path
+    )
+    return env
+
+
+def time_import(env) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", f"import {MODULE}"],
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+    return time.perf_counter() - start
+
+
+def slowest_modules(env):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # importtime indents nested imports by two spaces per level; keep
+        # the modules imported directly by MODULE.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 1 and name.split(".")[0] not in sys.stdlib_module_names:
+            rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:TOP]
+
+
+def main() -> int:
+    env = child_env()
+    # The interpreter alone, so the budget is about our imports.
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+    baseline = time.perf_counter() - start
+
+    timings = [time_import(env) for _ in range(RUNS)]
+    best = min(timings)
+    print(f"import {MODULE}: best {best:.2f}s, worst {max(timings):.2f}s")
+    print(f"interpreter startup: {baseline:.2f}s, budget: {BUDGET:.2f}s")
+    print("slowest direct imports (cumulative):")
+    for cumulative, name in slowest_modules(env):
+        print(f"  {cumulative / 1e6:6.2f}s  {name}")
+
+    if best > BUDGET:
+        print(f"FAIL: import took {best:.2f}s, over the {BUDGET:.2f}s budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Per-turn overhead of the chat graph as a session grows.
+
+Runs TURNS turns through the chat graph with a fake chat model, in two
+modes, and prints the average time per turn for each block of turns:
+
+  resend      no checkpointer; the whole message list is sent every turn,
+              which is what app.on_message used to do
+  checkpoint  AsyncSqliteSaver; only the new message is sent, the history
+              is loaded from the checkpoint and pruned after each turn, as
+              app.on_message does
+
+No API key or network access is needed.
+
+    python benchmarks/session_overhead.py
+    SESSION_TURNS=400 python benchmarks/session_overhead.py
+"""
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import HumanMessage
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+from logs_langchain import app  # noqa: E402
+
+TURNS = int(os.getenv("SESSION_TURNS", "200"))
+BLOCK = max(1, TURNS // 8)
+ANSWER = "Everything looks fine on that host. " * 20
+
+
+def fake_llm():
+    return GenericFakeChatModel(messages=itertools.cycle([ANSWER]))
+
+
+async def resend(graph, turns):
+    messages = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        state = await graph.ainvoke(
+            {"messages": messages + [HumanMessage(f"question {turn}")]}
+        )
+        messages = state["messages"]
+        yield time.perf_counter() - start
+
+
+async def checkpoint(graph, turns):
+    config = {"configurable": {"thread_id": "benchmark"}}
+    for turn in range(turns):
+        start = time.perf_counter()
+        state = await graph.ainvoke(
+            {"messages": [HumanMessage(f"question {turn}")]}, config
+        )
+        await app.prune_history(graph, config, state)
+        yield time.perf_counter() - start
+
+
+async def main():
+    llm = fake_llm()
+    app.get_llm = lambda: llm
+
+    with tempfile.TemporaryDirectory() as directory:
+        app.CHECKPOINT_PATH = os.path.join(directory, "checkpoints.sqlite")
+        graphs = {
+            "resend": (resend, app.build_state_graph()),
+            "checkpoint": (
+                checkpoint,
+                app.compile_state_graph(await app.get_checkpointer()),
+            ),
+        }
+        for name, (mode, graph) in graphs.items():
+            print(f"{name}:")
+            block, done = [], 0
+            async for elapsed in mode(graph, TURNS):
+                block.append(elapsed)
+                done += 1
+                if len(block) == BLOCK:
+                    print(
+                        f"  turns {done - BLOCK + 1:4}-{done:<4} "
+                        f"{sum(block) / len(block) * 1000:7.2f} ms/turn"
+                    )
+                    block = []
+        await app.checkpointer.conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,6 @@
 from langchain import hub
 from langchain_core.output_parsers import StrOutputParser, PydanticOutputParser
-from logs_langchain import factory, ingest, lograg, hosts, ssh, prompts
+from logs_langchain import factory, ingest, lograg, hosts, mapreduce, ssh, prompts
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,21 +18,14 @@ def handle_read_syslog(ssh_client, hostname, original_question, llm, prompts):
     remote_syslog_path = "/var/log/syslog"
     local_syslog_path = f"./temp/{hostname}_syslog"
     try:
-        ssh_client.download(remote_syslog_path, local_syslog_path)
-        print(f"Syslog downloaded to {local_syslog_path}")
+        ssh_client.sync(remote_syslog_path, local_syslog_path)
+        print(f"Syslog synced to {local_syslog_path}")
     except Exception as e:
         print(f"Failed to download syslog: {e}")
         return
-    with open(local_syslog_path, "r") as file:
-        syslog_content = file.read()
-    followup_chain = prompts.sysadmin_log_context_answer | llm | StrOutputParser()
-    max_syslog_length = 10000
-    truncated_syslog = syslog_content[:max_syslog_length]
-    answer = followup_chain.invoke(
-        {
-            "question": original_question,
-            "logs": truncated_syslog,
-        }
+    # Covers the whole file: segments are summarized in parallel and reduced.
+    answer = mapreduce.LogMapReduce(llm).answer_file(
+        original_question, local_syslog_path
     )
     print(f"Answer based on logs:\n{answer}")
 
@@ -1,30 +1,76 @@
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
-from langchain.output_parsers import PydanticOutputParser
-from langchain.schema import StrOutputParser
-from langchain.schema.runnable.config import RunnableConfig
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from chainlit.types import ThreadDict
 from langgraph.graph import END, StateGraph, START
 from langgraph.graph.message import MessagesState
 from langgraph.prebuilt import ToolNode
-from logs_langchain import factory, prompts, tools
+from logs_langchain import commandcheck, factory, history, prompts, tools
 from typing import cast, TypedDict, List, Optional, Literal
+import asyncio
 import chainlit as cl
+import functools
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
-# TODO don't use globals, use the cl.user_session
-google_factory = factory.GoogleFactory()
-llm = google_factory.llm(model="gemini-2.5-flash-preview-05-20")
-llm = llm.bind_tools(tools.all)
+
+@functools.cache
+def get_llm():
+    """The tool-bound chat model, built on first use rather than at import.
+
+    Importing this module (langgraph dev, chainlit, tests) therefore neither
+    loads the Google SDK nor needs GOOGLE_API_KEY.
+    """
+    google_factory = factory.GoogleFactory()
+    llm = google_factory.llm(model="gemini-2.5-flash-preview-05-20")
+    return llm.bind_tools(tools.all)
+
+
+# Chat sessions are checkpointed here so they survive restarts.
+CHECKPOINT_PATH = "./temp/chat_checkpoints.sqlite"
+checkpointer = None
+checkpointer_lock = asyncio.Lock()
+
+
+async def get_checkpointer():
+    """The SQLite checkpointer shared by all chat sessions, opened on first use."""
+    global checkpointer
+    async with checkpointer_lock:
+        if checkpointer is None:
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+            import aiosqlite
+
+            os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+            connection = await aiosqlite.connect(CHECKPOINT_PATH)
+            checkpointer = AsyncSqliteSaver(connection)
+            await checkpointer.setup()
+            logger.info(f"Chat checkpoints stored in {CHECKPOINT_PATH}")
+    return checkpointer
+
+
+# Nodes whose LLM output is the answer shown to the user, streamed token by token.
+STREAMED_NODES = {"general_chat", "explain", "ssh_explain"}
+# Name of the message that refuses a dangerous command. It is never
+# streamed, so on_message always sends it.
+REFUSAL_NAME = "dangerous_command_verification"
+# Bounds the history sent to the LLM on each turn; the graph state keeps it all.
+history_manager = history.HistoryManager(max_tokens=8000, keep_turns=2)
 
 
 def general_chat_node(state: MessagesState) -> MessagesState:
-    messages = state["messages"]
-    response = llm.invoke(messages)
+    messages = history_manager.fit(state["messages"])
+    response = get_llm().invoke(messages)
     return {"messages": [response]}
     # return {"messages": messages + [response]}
 
 
+async def ageneral_chat_node(state: MessagesState) -> MessagesState:
+    response = await get_llm().ainvoke(history_manager.fit(state["messages"]))
+    return {"messages": [response]}
+
+
 def router_tools_node(
     state: MessagesState,
 ) -> Literal["tools", "dangerous_command_verification", "__end__"]:
@@ -33,7 +79,7 @@ def router_tools_node(
     if hasattr(last_message, "tool_calls") and last_message.tool_calls:
         # write a switch case here based on last_message.tool_calls[0]
         match last_message.tool_calls[0].get("name"):
-            case "ssh_command":
+            case "ssh_command" | "ssh_fanout":
                 return "dangerous_command_verification"
             case _:
                 return "tools"
@@ -49,59 +95,117 @@ def router_explain_node(state: MessagesState) -> Literal["explain", "ssh_explain
 
 
 def explain_node(state: MessagesState) -> MessagesState:
-    messages = state["messages"]
+    messages = history_manager.fit(state["messages"])
     # tool_result = messages[-1].content
     # call = messages[-2]
-    response = llm.invoke(messages + [prompts.explain_command_result])
+    response = get_llm().invoke(messages + [prompts.explain_command_result])
     return {"messages": [response]}
 
 
-def ssh_explain_node(state: MessagesState) -> MessagesState:
-    messages = state["messages"]
+async def aexplain_node(state: MessagesState) -> MessagesState:
+    response = await get_llm().ainvoke(
+        history_manager.fit(state["messages"]) + [prompts.explain_command_result]
+    )
+    return {"messages": [response]}
+
+
+def ssh_explain_prompt(messages: List[BaseMessage]):
     question = messages[-3].content
     command = messages[-2].tool_calls[0].get("args").get("command")
     output = messages[-1].content
-
-    response = llm.invoke(
-        messages
-        + prompts.expert_linux_debugger.format_messages(
-            question=question, command=command, output=output
-        )
+    # The output is repeated in full by the expert prompt below.
+    chat_history = history_manager.fit(messages)
+    chat_history = history_manager.compact_last_tool_output(chat_history)
+    prompt = chat_history + prompts.expert_linux_debugger.format_messages(
+        question=question, command=command, output=output
     )
-
     # Let's always show an AIMessage with the command and output
     display_command = AIMessage(content=f"Command: {command}\nOutput:\n{output}")
+    return prompt, display_command
+
+
+def ssh_explain_node(state: MessagesState) -> MessagesState:
+    prompt, display_command = ssh_explain_prompt(state["messages"])
+    response = get_llm().invoke(prompt)
     return {"messages": [display_command, response]}
 
 
-def dangerous_command_verification_node(state: MessagesState) -> MessagesState:
-    messages = state["messages"]
-    tool_call = messages.pop(-1)
-    command = tool_call.tool_calls[0].get("args").get("command")
+async def assh_explain_node(state: MessagesState) -> MessagesState:
+    prompt, display_command = ssh_explain_prompt(state["messages"])
+    response = await get_llm().ainvoke(prompt)
+    return {"messages": [display_command, response]}
+
+
+def dangerous_command_chain():
     parser = PydanticOutputParser(pydantic_object=prompts.DangerousCommand)
-    chain = prompts.dangerous_command_verification | llm | parser
-    response = chain.invoke(
-        {"command": command, "format_instructions": parser.get_format_instructions()}
-    )
+    chain = prompts.dangerous_command_verification | get_llm() | parser
+    return chain, parser.get_format_instructions()
+
 
+def verification_result(messages, tool_call, command, response) -> MessagesState:
     if not response.is_dangerous:
         return {"messages": messages + [tool_call]}
     return {
         "messages": [
             AIMessage(
-                content=f"Cannot proceed.\nThe command `{command}` is considered dangerous.\nReason: {response.reason or 'No specific reason provided.'}"
+                name=REFUSAL_NAME,
+                content=f"Cannot proceed.\nThe command `{command}` is considered dangerous.\nReason: {response.reason or 'No specific reason provided.'}",
             )
         ]
     }
     # TODO maybe we should raise a consent check flag here so that the user can still force the command
 
 
+@functools.cache
+def verdict_cache() -> commandcheck.VerdictCache:
+    return commandcheck.VerdictCache("./temp/command_verdicts.sqlite")
+
+
+def known_verdict(command: str) -> Optional[prompts.DangerousCommand]:
+    """Verdict from the static analyzer or an earlier LLM check, if any."""
+    verdict = commandcheck.analyze(command)
+    if verdict is not None:
+        logger.info(f"Command `{command}` classified statically: {verdict.reason}")
+        return verdict
+    return verdict_cache().get(command)
+
+
+def dangerous_command_verification_node(state: MessagesState) -> MessagesState:
+    messages = state["messages"]
+    tool_call = messages.pop(-1)
+    command = tool_call.tool_calls[0].get("args").get("command")
+    response = known_verdict(command)
+    if response is None:
+        chain, format_instructions = dangerous_command_chain()
+        response = chain.invoke(
+            {"command": command, "format_instructions": format_instructions}
+        )
+        verdict_cache().put(command, response)
+    return verification_result(messages, tool_call, command, response)
+
+
+async def adangerous_command_verification_node(
+    state: MessagesState,
+) -> MessagesState:
+    messages = state["messages"]
+    tool_call = messages.pop(-1)
+    command = tool_call.tool_calls[0].get("args").get("command")
+    response = known_verdict(command)
+    if response is None:
+        chain, format_instructions = dangerous_command_chain()
+        response = await chain.ainvoke(
+            {"command": command, "format_instructions": format_instructions}
+        )
+        verdict_cache().put(command, response)
+    return verification_result(messages, tool_call, command, response)
+
+
 def router_after_verification(state: MessagesState) -> Literal["tools", "__end__"]:
     messages = state["messages"]
     last_message = messages[-1]
 
     # If the last message is an AIMessage saying the command is dangerous
-    if isinstance(last_message, AIMessage) and "dangerous" in last_message.content:
+    if isinstance(last_message, AIMessage) and last_message.name == REFUSAL_NAME:
         return "__end__"
     # Otherwise it's the original tool call put back in messages
     else:
@@ -109,15 +213,35 @@ def router_after_verification(state: MessagesState) -> Literal["tools", "__end__
 
 
 def build_state_graph():
+    """The graph without a checkpointer, for langgraph.json and LangGraph Studio.
+
+    langgraph-api calls graph factories with the RunnableConfig as their only
+    argument, so this one must not take a checkpointer.
+    """
+    return compile_state_graph()
+
+
+def compile_state_graph(checkpointer=None):
     builder = StateGraph(MessagesState)
 
-    builder.add_node("general_chat", general_chat_node)
+    # Every node works with both invoke and ainvoke. Under ainvoke the LLM
+    # calls are awaited and the ToolNode runs the blocking SSH tools in a
+    # thread pool, so the event loop is never blocked.
+    builder.add_node(
+        "general_chat", RunnableLambda(general_chat_node, afunc=ageneral_chat_node)
+    )
     tool_node = ToolNode(tools=tools.all)
     builder.add_node("tools", tool_node)
-    builder.add_node("explain", explain_node)
-    builder.add_node("ssh_explain", ssh_explain_node)
+    builder.add_node("explain", RunnableLambda(explain_node, afunc=aexplain_node))
     builder.add_node(
-        "dangerous_command_verification", dangerous_command_verification_node
+        "ssh_explain", RunnableLambda(ssh_explain_node, afunc=assh_explain_node)
+    )
+    builder.add_node(
+        "dangerous_command_verification",
+        RunnableLambda(
+            dangerous_command_verification_node,
+            afunc=adangerous_command_verification_node,
+        ),
     )
 
     builder.add_edge(START, "general_chat")
@@ -137,43 +261,67 @@ def build_state_graph():
         router_after_verification,
     )
 
-    return builder.compile()
+    return builder.compile(checkpointer=checkpointer)
+
+
+async def prune_history(graph, config, state: MessagesState) -> None:
+    """Shrink the checkpointed history so per-turn cost does not grow with it."""
+    updates = history_manager.prune(state["messages"])
+    if updates:
+        await graph.aupdate_state(config, {"messages": updates})
 
 
 @cl.on_chat_start
 async def start_chat():
-    graph = build_state_graph()
+    graph = compile_state_graph(await get_checkpointer())
     cl.user_session.set("graph", graph)
 
 
+@cl.on_chat_resume
+async def resume_chat(thread: ThreadDict):
+    # The conversation itself is loaded from the checkpoint by thread_id.
+    await start_chat()
+
+
 @cl.on_message
 async def on_message(message: cl.Message):
     graph = cl.user_session.get("graph")
-    config = {"configurable": {"thread_id": cl.context.session.id}}
+    # The checkpointer holds the history for this thread, so only the new
+    # message is sent.
+    config = {"configurable": {"thread_id": cl.context.session.thread_id}}
     cb = cl.LangchainCallbackHandler()
 
-    # Get existing messages (if any)
-    existing_messages = cl.user_session.get("messages", [])
-
-    # Add the new message
-    current_messages = existing_messages + [HumanMessage(content=message.content)]
-
-    # Save the updated messages in the session
-    cl.user_session.set("messages", current_messages)
-
-    # Run the graph
-    state = graph.invoke(
-        {"messages": current_messages},
+    # Run the graph, streaming answer tokens to the UI as they are generated
+    cl_msg = cl.Message(content="")
+    state = None
+    async for mode, chunk in graph.astream(
+        {"messages": [HumanMessage(content=message.content)]},
         config=RunnableConfig(callbacks=[cb], **config),
-    )
-
-    # Update session with the latest messages
-    cl.user_session.set("messages", state["messages"])
+        stream_mode=["messages", "values"],
+    ):
+        if mode == "values":
+            state = chunk
+            continue
+        message_chunk, metadata = chunk
+        if (
+            metadata.get("langgraph_node") in STREAMED_NODES
+            and isinstance(message_chunk, AIMessageChunk)
+            and isinstance(message_chunk.content, str)
+            and message_chunk.content
+        ):
+            await cl_msg.stream_token(message_chunk.content)
+
+    await prune_history(graph, config, state)
 
     # Send the response
-    if state["messages"]:
-        cl_msg = cl.Message(content=state["messages"][-1].content)
+    last_message = state["messages"][-1] if state and state["messages"] else None
+    if cl_msg.content:
         await cl_msg.send()
+    if last_message is not None and (
+        not cl_msg.content or last_message.name == REFUSAL_NAME
+    ):
+        # Text streamed next to a tool call must not hide a refusal.
+        await cl.Message(content=last_message.content).send()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+from logs_langchain import partitions
+from typing import Iterable, Set
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+QUERY_PARAMS = 900
+
+
+def document_key(metadata: dict):
+    """Return the (filepath, file_hash, generation, kind, host, bucket) of a chunk."""
+    if "ts_start" in metadata:
+        bucket = partitions.bucket_range(metadata["ts_start"])[0]
+    else:
+        bucket = partitions.UNDATED
+    return (
+        metadata.get("filepath", ""),
+        metadata.get("file_hash", ""),
+        metadata.get("generation", 0),
+        metadata.get("kind", "chunk"),
+        metadata.get("host") or partitions.UNKNOWN_HOST,
+        bucket,
+    )
+
+
+class CorpusCatalog:
+    """Document counts and byte totals of a vector store, kept in SQLite.
+
+    Updated in the same step as each batch is added to the vector store, so
+    statistics and whole-file dedup are answered from small aggregate tables
+    instead of by reading back the collection. Rows are kept per file (path,
+    content hash, generation and kind of document) and per host and day.
+    Document ids are recorded too, so re-adding a batch after an interrupted
+    ingest, which upserts the same ids, does not count it twice.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS files (
+                filepath TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                generation INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                documents INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                ts_start REAL,
+                ts_end REAL,
+                complete INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (filepath, file_hash, generation, kind)
+            );
+            CREATE INDEX IF NOT EXISTS files_by_hash ON files (file_hash, kind);
+            CREATE TABLE IF NOT EXISTS buckets (
+                host TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                documents INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                ts_start REAL,
+                ts_end REAL,
+                PRIMARY KEY (host, bucket, kind)
+            );
+            """
+        )
+
+    def add_documents(self, documents) -> int:
+        """Count the documents of one vector store batch. Returns how many were new."""
+        files = {}
+        buckets = {}
+        added = 0
+        with self.lock, self.db:
+            for doc in documents:
+                if doc.id is not None:
+                    cursor = self.db.execute(
+                        "INSERT OR IGNORE INTO documents VALUES (?)", (doc.id,)
+                    )
+                    if not cursor.rowcount:
+                        continue
+                added += 1
+                md = doc.metadata
+                key = document_key(md)
+                if "bytes" in md:
+                    size = md["bytes"]
+                else:
+                    size = len(doc.page_content.encode("utf-8"))
+                ts_start, ts_end = md.get("ts_start"), md.get("ts_end")
+                for totals, group in ((files, key[:4]), (buckets, key[3:])):
+                    total = totals.setdefault(group, [0, 0, ts_start, ts_end])
+                    total[0] += 1
+                    total[1] += size
+                    if ts_start is None:
+                        continue
+                    total[2] = ts_start if total[2] is None else min(total[2], ts_start)
+                    total[3] = ts_end if total[3] is None else max(total[3], ts_end)
+            self.db.executemany(
+                """
+                INSERT INTO files (filepath, file_hash, generation, kind,
+                                   documents, bytes, ts_start, ts_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT DO UPDATE SET
+                    documents = documents + excluded.documents,
+                    bytes = bytes + excluded.bytes,
+                    ts_start = min(coalesce(ts_start, excluded.ts_start),
+                                   coalesce(excluded.ts_start, ts_start)),
+                    ts_end = max(coalesce(ts_end, excluded.ts_end),
+                                 coalesce(excluded.ts_end, ts_end))
+                """,
+                [(*key, *total) for key, total in files.items()],
+            )
+            # buckets are keyed (kind, host, bucket) above.
+            self.db.executemany(
+                """
+                INSERT INTO buckets (kind, host, bucket,
+                                     documents, bytes, ts_start, ts_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT DO UPDATE SET
+                    documents = documents + excluded.documents,
+                    bytes = bytes + excluded.bytes,
+                    ts_start = min(coalesce(ts_start, excluded.ts_start),
+                                   coalesce(excluded.ts_start, ts_start)),
+                    ts_end = max(coalesce(ts_end, excluded.ts_end),
+                                 coalesce(excluded.ts_end, ts_end))
+                """,
+                [(*key, *total) for key, total in buckets.items()],
+            )
+        return added
+
+    def finish_file(self, file_path: str, file_hash: str, kind: str) -> None:
+        """Mark a whole file as fully indexed, so indexed_hashes reports it."""
+        with self.lock, self.db:
+            self.db.execute(
+                """
+                INSERT INTO files (filepath, file_hash, generation, kind, complete)
+                VALUES (?, ?, 0, ?, 1)
+                ON CONFLICT DO UPDATE SET complete = 1
+                """,
+                (file_path, file_hash, kind),
+            )
+
+    def indexed_hashes(self, file_hashes: Iterable[str], kind: str) -> Set[str]:
+        """Return which of file_hashes were fully indexed as kind, in one query."""
+        file_hashes = list(set(file_hashes))
+        rows = []
+        with self.lock:
+            # One query per QUERY_PARAMS hashes, to stay under SQLite's limit
+            # on bound parameters.
+            for i in range(0, len(file_hashes), QUERY_PARAMS):
+                batch = file_hashes[i : i + QUERY_PARAMS]
+                rows += self.db.execute(
+                    f"""
+                    SELECT DISTINCT file_hash FROM files
+                    WHERE kind = ? AND complete
+                    AND file_hash IN ({", ".join("?" * len(batch))})
+                    """,
+                    (kind, *batch),
+                ).fetchall()
+        return {row[0] for row in rows}
+
+    def files(self):
+        """Per file: (filepath, kind, documents, bytes, ts_start, ts_end)."""
+        with self.lock:
+            return self.db.execute(
+                """
+                SELECT filepath, kind, sum(documents), sum(bytes),
+                       min(ts_start), max(ts_end)
+                FROM files GROUP BY filepath, kind ORDER BY filepath, kind
+                """
+            ).fetchall()
+
+    def hosts(self):
+        """Per host: (host, kind, documents, bytes, ts_start, ts_end)."""
+        with self.lock:
+            return self.db.execute(
+                """
+                SELECT host, kind, sum(documents), sum(bytes),
+                       min(ts_start), max(ts_end)
+                FROM buckets GROUP BY host, kind ORDER BY host, kind
+                """
+            ).fetchall()
+
+    def buckets(self, host: str = None):
+        """Per host and day: (host, bucket, kind, documents, bytes, ts_start, ts_end)."""
+        query = (
+            "SELECT host, bucket, kind, documents, bytes, ts_start, ts_end FROM buckets"
+        )
+        params = ()
+        if host is not None:
+            query += " WHERE host = ?"
+            params = (host,)
+        with self.lock:
+            return self.db.execute(f"{query} ORDER BY host, bucket", params).fetchall()
+
+    def totals(self):
+        """Return (files, documents, bytes) over the whole corpus."""
+        with self.lock:
+            files = self.db.execute(
+                "SELECT count(DISTINCT filepath) FROM files WHERE documents > 0"
+            ).fetchone()[0]
+            documents, size = self.db.execute(
+                "SELECT coalesce(sum(documents), 0), coalesce(sum(bytes), 0) FROM buckets"
+            ).fetchone()
+        return files, documents, size
@@ -0,0 +1,78 @@
+from langchain_core.documents import Document
+from logs_langchain import logparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class LogChunker:
+    """Groups whole log lines into chunks for embedding.
+
+    A chunk is closed when adding the next line would exceed max_tokens, when
+    the next line is more than window_seconds after the first line of the
+    chunk, or when the host changes. Lines are never cut and chunks never
+    overlap. Lines without a timestamp (stack traces, wrapped output) stay with
+    the line before them.
+    """
+
+    kind = "chunk"
+
+    def __init__(self, max_tokens: int = 500, window_seconds: float = 600) -> None:
+        self.max_tokens = max_tokens
+        self.window_seconds = window_seconds
+
+    def make_document(self, lines, records, metadata) -> Document:
+        md = dict(metadata)
+        md["kind"] = self.kind
+        md["offset"] = lines[0][1]
+        md["line_start"] = lines[0][0]
+        md["line_end"] = lines[-1][0]
+        timestamps = [record.ts for record in records if record.ts is not None]
+        if timestamps:
+            md["ts_start"] = min(timestamps)
+            md["ts_end"] = max(timestamps)
+        hosts = [record.host for record in records if record.host]
+        if hosts:
+            md["host"] = hosts[0]
+        histogram = dict.fromkeys(logparse.SEVERITIES, 0)
+        for record in records:
+            histogram[record.severity] += 1
+        for severity, count in histogram.items():
+            md[f"sev_{severity}"] = count
+        return Document(
+            page_content="\n".join(text for _, _, text in lines), metadata=md
+        )
+
+    def split(self, lines, metadata):
+        """Yield Documents from an iterable of (line_no, byte_offset, text)."""
+        chunk, records = [], []
+        tokens = 0
+        chunk_start = chunk_host = None
+        for line in lines:
+            record = logparse.parse_line(line[2])
+            line_tokens = estimate_tokens(line[2])
+            if chunk and (
+                tokens + line_tokens > self.max_tokens
+                or (
+                    record.ts is not None
+                    and chunk_start is not None
+                    and abs(record.ts - chunk_start) > self.window_seconds
+                )
+                or (record.host and chunk_host and record.host != chunk_host)
+            ):
+                yield self.make_document(chunk, records, metadata)
+                chunk, records = [], []
+                tokens = 0
+                chunk_start = chunk_host = None
+            chunk.append(line)
+            records.append(record)
+            tokens += line_tokens
+            if chunk_start is None:
+                chunk_start = record.ts
+            chunk_host = chunk_host or record.host
+        if chunk:
+            yield self.make_document(chunk, records, metadata)
@@ -0,0 +1,489 @@
+from logs_langchain import prompts
+from typing import List, Optional
+import logging
+import os
+import re
+import shlex
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+SEPARATORS = {";", "&&", "||", "|", "&", "|&", "\n"}
+REDIRECTS = {">", ">>", ">|", "&>", "&>>", ">&", "<", "<<", "<<<", "<>"}
+SAFE_TARGETS = {"/dev/null", "/dev/stdout", "/dev/stderr"}
+# Commands that only run the command given after them, with the options
+# they accept: (flags, options that take a value, operands before the
+# command). Any other option makes the command unknown.
+WRAPPERS = {
+    "sudo": (
+        set(
+            """-A -b -E -H -k -n -P -S --askpass --background --preserve-env
+            --set-home --reset-timestamp --non-interactive --preserve-groups
+            --stdin""".split()
+        ),
+        set(
+            """-u -g -C -h -p -r -t -T -D -R --user --group --close-from --host
+            --prompt --role --type --command-timeout --chdir --chroot""".split()
+        ),
+        0,
+    ),
+    "nice": (set(), {"-n", "--adjustment"}, 0),
+    "nohup": (set(), set(), 0),
+    "time": ({"-p", "-v", "--portability", "--verbose"}, {"-f", "--format"}, 0),
+    "timeout": (
+        {"-v", "--verbose", "--preserve-status", "--foreground"},
+        {"-k", "-s", "--kill-after", "--signal"},
+        1,
+    ),
+    "stdbuf": (set(), {"-i", "-o", "-e", "--input", "--output", "--error"}, 0),
+    "ionice": ({"-t", "--ignore"}, {"-c", "-n", "--class", "--classdata"}, 0),
+    "env": (
+        {"-i", "-0", "--ignore-environment", "--null"},
+        {"-u", "-C", "--unset", "--chdir"},
+        0,
+    ),
+    "xargs": (
+        set(
+            """-0 -r -t -x -p -o --null --no-run-if-empty --verbose --exit
+            --interactive --open-tty""".split()
+        ),
+        set(
+            """-a -d -E -I -L -n -P -s --arg-file --delimiter --eof --replace
+            --max-lines --max-args --max-procs --max-chars
+            --process-slot-var""".split()
+        ),
+        0,
+    ),
+}
+# Directories whose programs are taken to be the system ones of that name.
+# A command run from anywhere else is unknown.
+SYSTEM_BIN_DIRS = {
+    "/bin",
+    "/sbin",
+    "/usr/bin",
+    "/usr/sbin",
+    "/usr/local/bin",
+    "/usr/local/sbin",
+}
+ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+
+READ_ONLY = set(
+    """[ awk basename blkid cat column cut date df dig dirname dmesg dpkg du echo
+    egrep false fgrep file find findmnt free getent grep groups head host
+    hostname hostnamectl id iostat journalctl jq last less ls lsblk lscpu lsmod
+    lsof lspci lsusb more mount netstat nl nproc nslookup pgrep ping printenv
+    printf ps pstree pwd readlink realpath sed sensors sort ss stat tail test
+    top tr tree true type uname uniq uptime vmstat w wc whereis which who whoami
+    zcat zgrep zless""".split()
+)
+DESTRUCTIVE = set(
+    """chattr chgrp chmod chown cp crontab dd fdisk groupadd groupdel halt init
+    install kill killall ln mkdir mkfs mkswap mv parted passwd pkill poweroff
+    reboot rm rmdir rsync scp shred shutdown swapoff tee touch truncate umount
+    useradd userdel usermod visudo wget wipefs""".split()
+)
+# Read-only and destructive subcommands of multi-purpose tools. Subcommands in
+# neither set are left to the LLM.
+SUBCOMMANDS = {
+    "systemctl": (
+        set(
+            """status show cat list-units list-unit-files list-timers
+            list-dependencies is-active is-enabled is-failed --failed""".split()
+        ),
+        set(
+            """start stop restart reload try-restart reload-or-restart enable
+            disable mask unmask kill isolate reboot poweroff halt edit
+            set-property daemon-reload reset-failed""".split()
+        ),
+    ),
+    "docker": (
+        set("ps logs inspect images stats top version info events port diff".split()),
+        set(
+            """rm rmi stop kill restart start run exec create prune pull push
+            build tag pause unpause update rename cp commit load import""".split()
+        ),
+    ),
+    "ip": (set("a addr address r route l link n neigh rule".split()), set()),
+    "apt": (
+        set("list show search policy depends rdepends".split()),
+        set(
+            """install remove purge upgrade full-upgrade dist-upgrade autoremove
+            update clean autoclean edit-sources""".split()
+        ),
+    ),
+    "apt-get": (
+        set(),
+        set(
+            """install remove purge upgrade dist-upgrade autoremove update clean
+            autoclean""".split()
+        ),
+    ),
+    "tailscale": (
+        set("status ip netcheck ping version whois".split()),
+        set("up down logout set cert serve funnel update".split()),
+    ),
+    "zfs": (set("list get".split()), set("destroy rollback set create rename".split())),
+    "zpool": (
+        set("status list iostat get history".split()),
+        set(
+            """destroy export import offline online replace clear scrub add remove
+            detach attach set""".split()
+        ),
+    ),
+}
+# Options that make an otherwise read-only command write or delete something.
+DESTRUCTIVE_OPTIONS = {
+    "sed": re.compile(r"^-(?:[a-zA-Z]*i|-in-place)"),
+    "find": re.compile(
+        r"^-(?:delete|exec|execdir|ok|okdir|fprint|fprint0|fprintf|fls)$"
+    ),
+    "journalctl": re.compile(r"^--(?:vacuum|rotate|flush|relinquish|setup-keys)"),
+    "dmesg": re.compile(r"^(?:-[a-zA-Z]*[cC]|--clear|--read-clear)"),
+    "crontab": re.compile(r".*"),
+    "awk": re.compile(r"^-i$|system\s*\(|print[^|]*>"),
+    "dpkg": re.compile(r"^-(?:i|r|P|-install|-remove|-purge|-configure)"),
+    "ss": re.compile(r"^(?:-[a-zA-Z]*K|--kill)$"),
+    # GNU long options may be abbreviated, and --co is already unambiguous.
+    "sort": re.compile(r"^--co"),
+}
+# Options of hostname that only print something. Anything else may set it.
+HOSTNAME_OPTIONS = set(
+    """-a -A -d -f -i -I -s -y --alias --all-fqdns --all-ip-addresses --domain
+    --fqdn --long --ip-address --short --nis""".split()
+)
+# Options that take a value, for the commands whose operands are counted.
+VALUE_OPTIONS = {
+    "date": {"-d", "--date", "-r", "--reference", "-f", "--file"},
+    "uniq": {"-f", "--skip-fields", "-s", "--skip-chars", "-w", "--check-chars"},
+}
+
+
+def allow(reason: str) -> prompts.DangerousCommand:
+    return prompts.DangerousCommand(is_dangerous=False, reason=reason)
+
+
+def deny(reason: str) -> prompts.DangerousCommand:
+    return prompts.DangerousCommand(is_dangerous=True, reason=reason)
+
+
+def tokenize(command: str) -> List[str]:
+    # A newline separates commands like ";" does, so it is lexed as
+    # punctuation rather than skipped as whitespace.
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=";&|<>\n")
+    lexer.whitespace = " \t\r"
+    lexer.whitespace_split = True
+    return list(lexer)
+
+
+def normalize(command: str) -> str:
+    # Only runs of spaces and tabs are collapsed. Anything that re-lexes the
+    # command loses the difference between a quoted `;` and a separator.
+    return re.sub(r"[ \t]+", " ", command.strip())
+
+
+def operands(binary: str, args: List[str]) -> List[str]:
+    """Return the arguments that are neither options nor option values."""
+    found = []
+    takes_value = VALUE_OPTIONS.get(binary, set())
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in takes_value:
+            skip = True
+        elif not arg.startswith("-") or arg == "-":
+            found.append(arg)
+    return found
+
+
+def skip_delimited(script: str, i: int, delimiter: str) -> int:
+    """Return the index just past the next unescaped delimiter from i."""
+    while i < len(script) and script[i] != delimiter:
+        if script[i] == "\\":
+            i += 1
+        i += 1
+    return i + 1
+
+
+def sed_script_writes(script: str) -> bool:
+    """True if a sed script may write files or run commands (e, w, W, s///e)."""
+    i = 0
+    while i < len(script):
+        c = script[i]
+        if c in " \t\n;{}!,$~+" or c.isdigit():
+            i += 1
+        elif c == "/":
+            i = skip_delimited(script, i + 1, "/")
+        elif c == "\\":
+            if i + 1 >= len(script):
+                return True
+            i = skip_delimited(script, i + 2, script[i + 1])
+        elif c in "sy":
+            if i + 1 >= len(script):
+                return True
+            delimiter = script[i + 1]
+            i = skip_delimited(script, i + 2, delimiter)
+            i = skip_delimited(script, i, delimiter)
+            flags = re.match(r"[A-Za-z0-9]*", script[i:]).group()
+            if c == "s" and set(flags) & set("ewW"):
+                return True
+            i += len(flags)
+        elif c in "ewW":
+            return True
+        elif c in "aic#rR":
+            # The rest of the line is text or a file name to read.
+            end = script.find("\n", i)
+            i = len(script) if end == -1 else end + 1
+        elif c.isalpha() or c in ":=":
+            # Labels and branches run to the end of the command.
+            end = re.search(r"[;\n}]", script[i + 1 :])
+            i = len(script) if end is None else i + 1 + end.start()
+        else:
+            return True
+    return False
+
+
+def safe_arguments(binary: str, args: List[str]) -> bool:
+    """Check that a READ_ONLY command is used in one of its read-only forms."""
+    if binary == "hostname":
+        return all(arg in HOSTNAME_OPTIONS for arg in args)
+    if binary == "hostnamectl":
+        return operands(binary, args) in ([], ["status"])
+    if binary == "date":
+        if any(re.match(r"^(?:-[a-zA-Z]*s|--set)", arg) for arg in args):
+            return False
+        return all(arg.startswith("+") for arg in operands(binary, args))
+    if binary in ("sort", "tree"):
+        return not any(re.match(r"^(?:-[a-zA-Z]*o|--o)", arg) for arg in args)
+    if binary == "uniq":
+        # A second operand is the output file.
+        return len(operands(binary, args)) <= 1
+    if binary == "sed":
+        scripts = []
+        expect_script = False
+        for arg in args:
+            if expect_script:
+                scripts.append(arg)
+                expect_script = False
+            elif arg in ("-e", "--expression"):
+                expect_script = True
+            elif arg.startswith("--expression="):
+                scripts.append(arg.split("=", 1)[1])
+            elif arg in ("-f", "--file") or arg.startswith("--file="):
+                return False
+        if not scripts:
+            scripts = operands(binary, args)[:1]
+        return not any(sed_script_writes(script) for script in scripts)
+    if binary == "awk":
+        if any(arg in ("-f", "--file") or arg.startswith("--file=") for arg in args):
+            return False
+        return not any("|" in arg or "getline" in arg for arg in args)
+    return True
+
+
+def split_commands(tokens: List[str]):
+    """Split tokens into simple commands, pulling out redirection targets."""
+    commands, current, redirects = [], [], []
+    expect_target = None
+    for token in tokens:
+        if expect_target is not None:
+            redirects.append((expect_target, token))
+            expect_target = None
+        elif token in SEPARATORS:
+            if current:
+                commands.append(current)
+            current = []
+        elif token in REDIRECTS:
+            # "2>&1" and friends duplicate a descriptor rather than write a file.
+            expect_target = token
+        else:
+            current.append(token)
+    if current:
+        commands.append(current)
+    return commands, redirects
+
+
+def command_name(word: str) -> Optional[str]:
+    """Return the program a command word runs, or None if it is not a system one."""
+    if "/" not in word:
+        return word
+    directory, name = os.path.split(word)
+    return name if directory in SYSTEM_BIN_DIRS else None
+
+
+def skip_options(binary: str, args: List[str]) -> Optional[int]:
+    """Return the index of the command a WRAPPERS binary runs, or None if unsure."""
+    flags, valued, operands = WRAPPERS[binary]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "--":
+            i += 1
+            break
+        if not arg.startswith("-") or arg == "-":
+            break
+        if arg.startswith("--"):
+            name = arg.split("=", 1)[0]
+            if name in flags:
+                i += 1
+            elif name in valued:
+                i += 1 if "=" in arg else 2
+            else:
+                return None
+            continue
+        if binary == "nice" and re.fullmatch(r"-\d+", arg):
+            i += 1
+            continue
+        # A cluster of short flags, optionally ending in one that takes a
+        # value, either attached or as the next argument.
+        for j, letter in enumerate(arg[1:], 1):
+            if f"-{letter}" in valued:
+                i += 1 if j + 1 < len(arg) else 2
+                break
+            if f"-{letter}" not in flags:
+                return None
+        else:
+            i += 1
+    i += operands
+    return i if i <= len(args) else None
+
+
+def strip_wrappers(words: List[str]) -> Optional[List[str]]:
+    """Return the command run under any wrappers, or None if it can't be told."""
+    while words:
+        if ASSIGNMENT.match(words[0]):
+            # Variables such as LD_PRELOAD or LESSOPEN can make any program
+            # run something else.
+            return None
+        binary = command_name(words[0])
+        if binary not in WRAPPERS or binary == "xargs":
+            break
+        start = skip_options(binary, words[1:])
+        if start is None:
+            return None
+        words = words[1 + start :]
+    return words
+
+
+def check_simple(words: List[str]) -> Optional[prompts.DangerousCommand]:
+    words = strip_wrappers(words)
+    if words is None:
+        return None
+    if not words:
+        return allow("Empty command.")
+    binary = command_name(words[0])
+    if binary is None:
+        return None
+    args = words[1:]
+
+    if binary == "xargs":
+        start = skip_options(binary, args)
+        if start is None:
+            return None
+        rest = args[start:]
+        return check_simple(rest) if rest else allow("xargs echo is read-only.")
+    if binary in ("sh", "bash", "zsh", "dash", "eval", "exec", "source", "."):
+        return None
+    if binary in DESTRUCTIVE or binary.startswith("mkfs."):
+        return deny(
+            f"`{binary}` can modify or delete files, processes or system state."
+        )
+
+    pattern = DESTRUCTIVE_OPTIONS.get(binary)
+    if pattern is not None and any(pattern.search(arg) for arg in args):
+        return deny(f"`{binary}` is used with an option that modifies the system.")
+
+    if binary == "docker" and args[:1] == ["compose"]:
+        args = args[1:]
+    if binary in SUBCOMMANDS:
+        read_only, destructive = SUBCOMMANDS[binary]
+        subcommand = next((arg for arg in args if not arg.startswith("-")), None)
+        if subcommand is None and binary in ("systemctl", "ip"):
+            return allow(f"`{binary}` without a subcommand only lists state.")
+        if subcommand in destructive or (binary == "docker" and "prune" in args):
+            return deny(f"`{binary} {subcommand}` changes system or service state.")
+        if subcommand in read_only:
+            # ip addr add / ip route del and the like
+            if binary == "ip" and any(
+                arg in ("add", "del", "delete", "change", "replace", "set", "flush")
+                for arg in args
+            ):
+                return deny("`ip` is used to change network configuration.")
+            return allow(f"`{binary} {subcommand}` is read-only.")
+        return None
+
+    if binary == "mount" and args:
+        return deny("`mount` with arguments changes mounted filesystems.")
+    if binary == "top" and "-b" not in args:
+        return None
+    if binary in READ_ONLY and safe_arguments(binary, args):
+        return allow(f"`{binary}` is read-only.")
+    return None
+
+
+def analyze(command: str) -> Optional[prompts.DangerousCommand]:
+    """Statically classify a shell command.
+
+    Returns a DangerousCommand verdict for commands made only of known
+    read-only or known destructive pieces, or None when the command needs a
+    closer look.
+    """
+    if "`" in command or "$(" in command or "<(" in command or ">(" in command:
+        return None
+    try:
+        tokens = tokenize(command)
+    except ValueError:
+        return None
+    if any("\n" in token for token in tokens):
+        return None
+    commands, redirects = split_commands(tokens)
+    for operator, target in redirects:
+        if operator.startswith("<") or ("&" in operator and target.isdigit()):
+            continue
+        if target not in SAFE_TARGETS:
+            return deny(f"The command writes to `{target}`.")
+    verdicts = [check_simple(words) for words in commands]
+    for verdict in verdicts:
+        if verdict is not None and verdict.is_dangerous:
+            return verdict
+    if verdicts and all(verdict is not None for verdict in verdicts):
+        return allow("Every part of the command is read-only.")
+    return None
+
+
+class VerdictCache:
+    """Persistent LLM verdicts for commands the static analyzer can't decide."""
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS verdicts (
+                command TEXT PRIMARY KEY,
+                is_dangerous INTEGER NOT NULL,
+                reason TEXT
+            )
+            """
+        )
+
+    def get(self, command: str) -> Optional[prompts.DangerousCommand]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT is_dangerous, reason FROM verdicts WHERE command = ?",
+                (normalize(command),),
+            ).fetchone()
+        if row is None:
+            return None
+        return prompts.DangerousCommand(is_dangerous=bool(row[0]), reason=row[1])
+
+    def put(self, command: str, verdict: prompts.DangerousCommand) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?)",
+                (normalize(command), verdict.is_dangerous, verdict.reason),
+            )
@@ -0,0 +1,146 @@
+from langchain_core.documents import Document
+from logs_langchain import chunking, logparse
+from typing import List
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class Block:
+    """A run of consecutive lines from one file, built from one or more chunks."""
+
+    def __init__(self, doc: Document, rank: int) -> None:
+        self.metadata = dict(doc.metadata)
+        self.lines = doc.page_content.split("\n")
+        self.rank = rank
+
+    def source(self):
+        md = self.metadata
+        return md.get("filepath"), md.get("file_hash"), md.get("generation")
+
+    @property
+    def line_start(self):
+        return self.metadata.get("line_start")
+
+    @property
+    def line_end(self):
+        return self.metadata.get("line_end")
+
+    def mergeable(self, other: "Block") -> bool:
+        return (
+            self.metadata.get("kind", "chunk") == "chunk"
+            and other.metadata.get("kind", "chunk") == "chunk"
+            and self.source() == other.source()
+            and self.line_end is not None
+            and other.line_start is not None
+            and other.line_start <= self.line_end + 1
+        )
+
+    def merge(self, other: "Block") -> None:
+        """Append other, which starts at or before the line after this one ends."""
+        skip = self.line_end - other.line_start + 1
+        if skip < len(other.lines):
+            self.lines.extend(other.lines[skip:])
+            self.metadata["line_end"] = other.line_end
+        for key, pick in (("ts_start", min), ("ts_end", max)):
+            values = [md[key] for md in (self.metadata, other.metadata) if key in md]
+            if values:
+                self.metadata[key] = pick(values)
+        self.rank = min(self.rank, other.rank)
+
+    def truncate(self, max_tokens: int) -> None:
+        """Drop trailing lines until the block fits in max_tokens."""
+        while len(self.lines) > 1 and (
+            chunking.estimate_tokens(self.text()) > max_tokens
+        ):
+            self.lines.pop()
+        if self.line_start is None or self.metadata.get("kind") == "template":
+            return
+        self.metadata["line_end"] = self.line_start + len(self.lines) - 1
+        timestamps = [logparse.parse_line(line).ts for line in self.lines]
+        timestamps = [ts for ts in timestamps if ts is not None]
+        if timestamps:
+            self.metadata["ts_start"] = min(timestamps)
+            self.metadata["ts_end"] = max(timestamps)
+
+    def header(self) -> str:
+        md = self.metadata
+        parts = []
+        if md.get("kind") == "template":
+            parts.append(f"template seen {md.get('count')} times")
+        if md.get("filepath"):
+            source = os.path.basename(md["filepath"])
+            if self.line_start is not None:
+                source += f" lines {self.line_start}-{self.line_end}"
+            parts.append(source)
+        if md.get("host"):
+            parts.append(f"host {md['host']}")
+        if "ts_start" in md:
+            parts.append(
+                f"{logparse.format_time(md['ts_start'])} to "
+                f"{logparse.format_time(md['ts_end'])}"
+            )
+        return f"[{' | '.join(parts)}]" if parts else ""
+
+    def text(self) -> str:
+        header = self.header()
+        body = "\n".join(self.lines)
+        return f"{header}\n{body}" if header else body
+
+    def sort_key(self):
+        md = self.metadata
+        return (
+            md.get("ts_start", float("inf")),
+            str(md.get("filepath")),
+            self.line_start or 0,
+        )
+
+
+def merge_blocks(docs: List[Document]) -> List[Block]:
+    """Drop duplicate hits and merge overlapping or adjacent chunks per file."""
+    seen = set()
+    blocks = []
+    for rank, doc in enumerate(docs):
+        key = doc.id or doc.page_content
+        if key in seen:
+            continue
+        seen.add(key)
+        blocks.append(Block(doc, rank))
+
+    blocks.sort(key=lambda block: (str(block.source()), block.line_start or 0))
+    merged = []
+    for block in blocks:
+        if merged and merged[-1].mergeable(block):
+            merged[-1].merge(block)
+        else:
+            merged.append(block)
+    return merged
+
+
+def pack_context(docs: List[Document], max_tokens: int = 4000) -> str:
+    """Assemble retrieved docs into a prompt context of at most max_tokens.
+
+    Overlapping and adjacent chunks are merged into single blocks. Blocks are
+    kept in retrieval rank order until the budget is used up (the best block
+    is cut down to fit if it alone is too large), then presented in
+    chronological order, each under a header naming its file, line range,
+    host and time range.
+    """
+    blocks = merge_blocks(docs)
+    chosen = []
+    used = 0
+    for block in sorted(blocks, key=lambda block: block.rank):
+        tokens = chunking.estimate_tokens(block.text())
+        if used + tokens > max_tokens:
+            if chosen:
+                continue
+            block.truncate(max_tokens)
+            tokens = chunking.estimate_tokens(block.text())
+        chosen.append(block)
+        used += tokens
+    logger.debug(
+        f"Packed {len(docs)} documents into {len(chosen)} blocks, ~{used} tokens"
+    )
+    chosen.sort(key=Block.sort_key)
+    return "\n\n".join(block.text() for block in chosen)
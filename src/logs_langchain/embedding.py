@@ -0,0 +1,364 @@
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.embeddings import Embeddings
+from array import array
+from logs_langchain import lexical
+from typing import TYPE_CHECKING, Dict, List
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitError(Exception):
+    code = 429
+
+
+def is_retryable(e: Exception) -> bool:
+    code = getattr(e, "code", None) or getattr(e, "status_code", None)
+    if code in (429, 503):
+        return True
+    # google.api_core raises ResourceExhausted / ServiceUnavailable, and the
+    # genai client sometimes only carries the status in the message.
+    text = f"{type(e).__name__} {e}"
+    return any(
+        marker in text
+        for marker in ("429", "ResourceExhausted", "RESOURCE_EXHAUSTED", "503")
+    )
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingScheduler(Embeddings):
+    """Embeds documents in sized batches across a pool of workers.
+
+    Every batch draws one token per text from a shared bucket refilled at
+    texts_per_minute, and rate-limited or unavailable responses are retried
+    with full-jitter exponential backoff.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = 64,
+        max_workers: int = 4,
+        texts_per_minute: float = 1500,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(texts_per_minute / 60, max(batch_size, 1))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"texts": 0, "batches": 0, "retries": 0, "seconds": 0.0}
+        self.stats_lock = threading.Lock()
+
+    def _call(self, func, arg, tokens: int):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(tokens)
+            try:
+                return func(arg)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                logger.warning(
+                    f"Embedding request failed ({e}), retrying in {delay:.2f}s"
+                )
+                with self.stats_lock:
+                    self.stats["retries"] += 1
+                time.sleep(delay)
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        return self._call(self.embeddings.embed_documents, batch, len(batch))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [
+            texts[i : i + self.batch_size]
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(self._embed_batch, batches))
+        elapsed = time.monotonic() - start
+
+        with self.stats_lock:
+            self.stats["texts"] += len(texts)
+            self.stats["batches"] += len(batches)
+            self.stats["seconds"] += elapsed
+        logger.info(
+            f"Embedded {len(texts)} texts in {len(batches)} batches in {elapsed:.2f}s ({self.throughput():.1f} texts/s overall, {self.stats['retries']} retries)"
+        )
+        return [vector for result in results for vector in result]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(self.embeddings.embed_query, text, 1)
+
+    def throughput(self) -> float:
+        if not self.stats["seconds"]:
+            return 0.0
+        return self.stats["texts"] / self.stats["seconds"]
+
+
+class FlakyEmbeddings(Embeddings):
+    """Local stand-in for a remote embedding API.
+
+    Adds latency to every call and fails a fraction of them with a 429, which
+    is enough to exercise EmbeddingScheduler without network access.
+    """
+
+    def __init__(
+        self,
+        size: int = 768,
+        latency: float = 0.05,
+        rate_limit_probability: float = 0.1,
+        seed: int = 0,
+    ) -> None:
+        # Deferred like numpy in HashingEmbeddings, which it imports.
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        self.embeddings = DeterministicFakeEmbedding(size=size)
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def _request(self) -> None:
+        with self.lock:
+            self.calls += 1
+            limited = self.random.random() < self.rate_limit_probability
+        time.sleep(self.latency)
+        if limited:
+            raise RateLimitError("429 Resource has been exhausted (e.g. check quota).")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._request()
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._request()
+        return self.embeddings.embed_query(text)
+
+
+class HashingEmbeddings(Embeddings):
+    """Offline embeddings by feature hashing, computed with NumPy on the CPU.
+
+    Tokens (see lexical.tokenize) and adjacent token pairs are hashed into
+    size signed buckets, weighted by log(1 + count) and L2 normalized. Texts
+    sharing identifiers and words end up close together, which is most of
+    what log retrieval needs. Vectors are the same on every run and machine,
+    and no API key or network access is needed.
+    """
+
+    def __init__(self, size: int = 768, bigrams: bool = True) -> None:
+        self.size = size
+        self.bigrams = bigrams
+        # Hashing is the slow part and log vocabularies are small.
+        self.buckets: Dict[str, int] = {}
+
+    def bucket(self, feature: str) -> int:
+        """Signed bucket of feature: index + 1, negated for a negative sign."""
+        found = self.buckets.get(feature)
+        if found is None:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            found = (value % self.size) + 1
+            if value >> 63:
+                found = -found
+            if len(self.buckets) < 1_000_000:
+                self.buckets[feature] = found
+        return found
+
+    def features(self, text: str) -> List[int]:
+        tokens = lexical.tokenize(text)
+        features = tokens
+        if self.bigrams:
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        get = self.buckets.get
+        return [get(feature) or self.bucket(feature) for feature in features]
+
+    def embed_array(self, texts: List[str]) -> "np.ndarray":
+        # Imported here so that importing factory does not load numpy.
+        import numpy as np
+
+        rows, buckets = [], []
+        for row, text in enumerate(texts):
+            features = self.features(text)
+            rows.extend([row] * len(features))
+            buckets.extend(features)
+        buckets = np.asarray(buckets, dtype=np.int64)
+        matrix = np.zeros((len(texts), self.size), dtype=np.float32)
+        np.add.at(
+            matrix,
+            (np.asarray(rows, dtype=np.int64), np.abs(buckets) - 1),
+            np.sign(buckets).astype(np.float32),
+        )
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Disk-backed embedding cache keyed by (model, sha256 of the text).
+
+    Vectors live in a SQLite table as float32 blobs. When the table grows past
+    max_entries the least recently used tenth is evicted.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        path: str,
+        model: str,
+        max_entries: int = 100_000,
+    ) -> None:
+        self.embeddings = embeddings
+        self.path = path
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, digest)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+            """
+        )
+        (self.entries,) = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, model: str, digests: List[str]) -> dict:
+        found = {}
+        now = time.time()
+        with self.lock, self.db:
+            for i in range(0, len(digests), 500):
+                chunk = digests[i : i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self.db.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({marks})",
+                    [model, *chunk],
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = array("f", blob).tolist()
+                self.db.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE model = ? AND digest IN ({marks})",
+                    [now, model, *chunk],
+                )
+        return found
+
+    def _store(self, model: str, vectors: dict) -> None:
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [
+                    (model, digest, array("f", vector).tobytes(), now)
+                    for digest, vector in vectors.items()
+                ],
+            )
+            self.entries += len(vectors)
+            if self.entries > self.max_entries:
+                keep = int(self.max_entries * 0.9)
+                self.db.execute(
+                    "DELETE FROM embeddings WHERE (model, digest) IN (SELECT model, digest FROM embeddings ORDER BY last_used LIMIT ?)",
+                    [self.entries - keep],
+                )
+                (self.entries,) = self.db.execute(
+                    "SELECT COUNT(*) FROM embeddings"
+                ).fetchone()
+                logger.info(f"Evicted embedding cache down to {self.entries} entries")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        digests = [self.digest(text) for text in texts]
+        vectors = self._lookup(self.model, list(set(digests)))
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if digest not in vectors:
+                missing.setdefault(digest, text)
+        self._count(len(texts) - len(missing), len(missing))
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            self._store(self.model, new_vectors)
+            vectors.update(new_vectors)
+        logger.debug(f"Embedding cache hits={self.hits} misses={self.misses}")
+        return [vectors[digest] for digest in digests]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Query embeddings use a different task type than documents, so they
+        # are cached under their own key space.
+        model = f"{self.model}#query"
+        digest = self.digest(text)
+        vector = self._lookup(model, [digest]).get(digest)
+        if vector is not None:
+            self._count(1, 0)
+            return vector
+        self._count(0, 1)
+        vector = self.embeddings.embed_query(text)
+        self._store(model, {digest: vector})
+        return vector
+
+    def _count(self, hits: int, misses: int) -> None:
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -1,10 +1,17 @@
-from chromadb.config import Settings
 from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_core.embeddings import Embeddings
+from logs_langchain import embedding
+from typing import TYPE_CHECKING, Optional
 import logging
 import os
 
+# chromadb and the Google SDK take seconds to import, so they are only
+# imported when a client is actually built.
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from logs_langchain.partitions import PartitionedVectorStore
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,16 +27,62 @@ class GoogleFactory:
             exit()
         logging.info("GOOGLE_API_KEY successfully loaded from environment.")
 
-    def llm(self, model: str = "gemini-2.0-flash", **kwargs) -> ChatGoogleGenerativeAI:
+    def llm(
+        self, model: str = "gemini-2.0-flash", **kwargs
+    ) -> "ChatGoogleGenerativeAI":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
         return ChatGoogleGenerativeAI(model=model, **kwargs)
 
     def embeddings(
-        self, model: str = "models/embedding-001", **kwargs
-    ) -> GoogleGenerativeAIEmbeddings:
-        return GoogleGenerativeAIEmbeddings(model=model, **kwargs)
+        self,
+        model: str = "models/embedding-001",
+        cache_path: str = None,
+        schedule: bool = False,
+        **kwargs,
+    ) -> Embeddings:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        embeddings = GoogleGenerativeAIEmbeddings(model=model, **kwargs)
+        if schedule:
+            embeddings = embedding.EmbeddingScheduler(embeddings)
+        if cache_path is not None:
+            # Outermost, so cache hits never spend rate limit quota.
+            embeddings = embedding.CachedEmbeddings(embeddings, cache_path, model)
+        return embeddings
+
+
+class LocalFactory:
+    """Embeddings computed on the local CPU, for offline runs and backfills.
+
+    No API key is needed. Vectors are not comparable with Google's, so keep
+    them in their own persist_directory.
+    """
+
+    def embeddings(self, size: int = 768, **kwargs) -> Embeddings:
+        # cache_path and schedule are accepted so callers can switch backends
+        # freely; hashing is faster than a cache lookup and has no rate limit.
+        return embedding.HashingEmbeddings(size=size)
+
 
+EMBEDDING_BACKENDS = {"google": GoogleFactory, "local": LocalFactory}
+
+
+def embeddings(backend: Optional[str] = None, **kwargs) -> Embeddings:
+    """Embeddings from the named backend, or $EMBEDDING_BACKEND (default google)."""
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "google")
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend {backend!r}, expected one of {sorted(EMBEDDING_BACKENDS)}"
+        )
+    logger.info(f"Using the {backend} embedding backend")
+    return EMBEDDING_BACKENDS[backend]().embeddings(**kwargs)
+
+
+def vector_store(emb_func, persist_directory: str = None) -> "Chroma":
+    from chromadb.config import Settings
+    from langchain_chroma import Chroma
 
-def vector_store(emb_func, persist_directory: str = None):
     vector_store = Chroma(
         client_settings=Settings(anonymized_telemetry=False),
         collection_name="lograg",
@@ -38,3 +91,21 @@ def vector_store(emb_func, persist_directory: str = None):
     )
     logger.info("Chroma vector store initialized")
     return vector_store
+
+
+def partitioned_vector_store(
+    emb_func, persist_directory: str = None, bucket: str = "day"
+) -> "PartitionedVectorStore":
+    """Like vector_store, but with a collection per host and day (or week)."""
+    from chromadb.config import Settings
+    from logs_langchain import partitions
+    import chromadb
+
+    settings = Settings(anonymized_telemetry=False)
+    if persist_directory is None:
+        client = chromadb.EphemeralClient(settings=settings)
+    else:
+        client = chromadb.PersistentClient(path=persist_directory, settings=settings)
+    vector_store = partitions.PartitionedVectorStore(emb_func, client, bucket=bucket)
+    logger.info("Partitioned Chroma vector store initialized")
+    return vector_store
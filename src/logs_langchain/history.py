@@ -0,0 +1,209 @@
+from langchain_core.messages import (
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from logs_langchain import chunking
+from typing import List, Optional
+import functools
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+PROBLEM = re.compile(r"\b(?:error|fail(?:ed|ure)?|fatal|panic|denied|refused)\b", re.I)
+# Name of the SystemMessage that stands in for dropped turns, and how many of
+# their questions it lists.
+SUMMARY_NAME = "history_summary"
+SUMMARY_QUESTIONS = 20
+
+
+def count_tokens(message: BaseMessage) -> int:
+    content = message.content
+    if not isinstance(content, str):
+        content = " ".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    tokens = chunking.estimate_tokens(content)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += chunking.estimate_tokens(str(tool_call.get("args")))
+    return tokens
+
+
+# Older turns are digested again on every call, so remember the results.
+@functools.lru_cache(maxsize=256)
+def digest(text: str, max_tokens: int) -> str:
+    """Shorten text to roughly max_tokens, keeping its first and last lines.
+
+    The elided middle is replaced by a note of how many lines were dropped and
+    how many of those looked like errors, so the model still knows the output
+    existed and whether it was interesting.
+    """
+    if chunking.estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.splitlines()
+    half = max_tokens * 4 // 2
+    head, used = 0, 0
+    while head < len(lines) and used + len(lines[head]) < half:
+        used += len(lines[head]) + 1
+        head += 1
+    tail, used = len(lines), 0
+    while tail > head and used + len(lines[tail - 1]) < half:
+        used += len(lines[tail - 1]) + 1
+        tail -= 1
+    if head == 0 and tail == len(lines):
+        # A single very long line.
+        return f"{text[:half]} ... [{len(text) - half} characters omitted]"
+    dropped = lines[head:tail]
+    problems = sum(1 for line in dropped if PROBLEM.search(line))
+    note = f"... [{len(dropped)} lines omitted"
+    if problems:
+        note += f", {problems} mentioning errors or failures"
+    return "\n".join(lines[:head] + [note + "] ..."] + lines[tail:])
+
+
+class HistoryManager:
+    """Keeps the chat history sent to the LLM within a token budget.
+
+    The last keep_turns turns (a turn starts at a HumanMessage) are sent
+    verbatim. In older turns, tool outputs are cut down to digests of
+    tool_tokens and other long messages to message_tokens. If the history is
+    still over max_tokens, whole turns are dropped oldest first and replaced
+    by a short note listing the questions they asked. Cutting only at
+    HumanMessage boundaries keeps every tool call next to its result.
+
+    The note is carried in the history itself, so turns dropped by an
+    earlier prune are still counted when later ones are dropped.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 8000,
+        keep_turns: int = 2,
+        tool_tokens: int = 200,
+        message_tokens: int = 1000,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.tool_tokens = tool_tokens
+        self.message_tokens = message_tokens
+
+    @staticmethod
+    def turns(messages: List[BaseMessage]):
+        """Split messages into (leading system messages, list of turns)."""
+        system, turns = [], []
+        for message in messages:
+            if isinstance(message, SystemMessage) and not turns:
+                system.append(message)
+                continue
+            if isinstance(message, HumanMessage) or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return system, turns
+
+    def compact(self, message: BaseMessage) -> BaseMessage:
+        if isinstance(message, HumanMessage) or not isinstance(message.content, str):
+            return message
+        limit = (
+            self.tool_tokens
+            if isinstance(message, ToolMessage)
+            else self.message_tokens
+        )
+        if count_tokens(message) <= limit:
+            return message
+        return message.model_copy(update={"content": digest(message.content, limit)})
+
+    def compact_last_tool_output(
+        self, messages: List[BaseMessage]
+    ) -> List[BaseMessage]:
+        """Digest the final ToolMessage, for prompts that repeat it in full."""
+        if messages and isinstance(messages[-1], ToolMessage):
+            last = messages[-1]
+            content = digest(last.content, self.tool_tokens)
+            return messages[:-1] + [last.model_copy(update={"content": content})]
+        return messages
+
+    @staticmethod
+    def summary(
+        previous: Optional[SystemMessage], dropped: List[List[BaseMessage]]
+    ) -> SystemMessage:
+        """The note for dropped turns, merged into the note from a prior prune."""
+        count, questions = 0, []
+        if previous is not None:
+            count = previous.additional_kwargs.get("dropped_turns", 0)
+            questions = list(previous.additional_kwargs.get("questions", []))
+        count += len(dropped)
+        questions += [
+            digest(turn[0].content, 50)
+            for turn in dropped
+            if isinstance(turn[0], HumanMessage) and isinstance(turn[0].content, str)
+        ]
+        questions = questions[-SUMMARY_QUESTIONS:]
+        note = f"{count} earlier turns were removed to save space."
+        if questions:
+            note += " The user had asked:\n" + "\n".join(
+                f"- {question}" for question in questions
+            )
+        # Reusing the id of the first dropped message makes prune replace it
+        # in place, where the leading system messages end.
+        return SystemMessage(
+            content=note,
+            name=SUMMARY_NAME,
+            id=previous.id if previous is not None else dropped[0][0].id,
+            additional_kwargs={"dropped_turns": count, "questions": questions},
+        )
+
+    def fit(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        system, turns = self.turns(messages)
+        previous = next((m for m in system if m.name == SUMMARY_NAME), None)
+        system = [m for m in system if m is not previous]
+        recent = turns[-self.keep_turns :] if self.keep_turns else []
+        older = [
+            [self.compact(message) for message in turn]
+            for turn in turns[: len(turns) - len(recent)]
+        ]
+
+        def size(turn):
+            return sum(count_tokens(message) for message in turn)
+
+        budget = self.max_tokens - sum(count_tokens(m) for m in system)
+        recent_size = sum(size(turn) for turn in recent)
+        # The latest turn is always kept, even when it alone is over budget.
+        while len(recent) > 1 and recent_size > budget:
+            recent_size -= size(recent[0])
+            older.append([self.compact(message) for message in recent.pop(0)])
+        older_sizes = [size(turn) for turn in older]
+        total = recent_size + sum(older_sizes)
+        dropped = []
+        while older and total > budget:
+            total -= older_sizes.pop(0)
+            dropped.append(older.pop(0))
+
+        kept = system
+        if dropped:
+            kept = kept + [self.summary(previous, dropped)]
+            logger.debug(f"Dropped {len(dropped)} turns from the chat history")
+        elif previous is not None:
+            kept = kept + [previous]
+        return kept + [m for turn in older + recent for m in turn]
+
+    def prune(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """Updates that shrink a stored history to what fit() would still send.
+
+        Turns fit() drops are removed and older messages are replaced by their
+        digests, matched by id, so a checkpointed history stays about
+        max_tokens in size however long the session runs.
+        """
+        fitted = {message.id: message for message in self.fit(messages) if message.id}
+        updates = []
+        for message in messages:
+            if message.id is None:
+                continue
+            if message.id not in fitted:
+                updates.append(RemoveMessage(id=message.id))
+            elif fitted[message.id].content != message.content:
+                updates.append(fitted[message.id])
+        return updates
@@ -1,40 +1,628 @@
-from chromadb.config import Settings
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from concurrent.futures import ProcessPoolExecutor
+from logs_langchain import chunking, logfamily
+import collections
 import hashlib
+import itertools
 import logging
+import multiprocessing
+import os
+import queue
 
 logger = logging.getLogger(__name__)
 
+# Bytes read from disk at a time, and documents sent to the vector store per
+# add_documents call. Together they bound peak memory regardless of file size.
+# BATCH_SIZE is a multiple of the embedding.EmbeddingScheduler batch size so a
+# single flush keeps all of its workers busy.
+BLOCK_SIZE = 1024 * 1024
+BATCH_SIZE = 512
+# Lines an ingest_archives worker sends to this process at a time, and how
+# many such pieces of each file may wait to be added to the vector store.
+PIECE_LINES = 65536
+QUEUED_PIECES = 2
+# Bytes before the last ingested offset that are hashed to detect a file that
+# was truncated and then grew back past where we stopped.
+TAIL_HASH_BYTES = 1024
 
-def ingest_files(file_paths, vector_store):
-    docs = []
+
+def read_blocks(f, block_size=BLOCK_SIZE):
+    return iter(lambda: f.read(block_size), b"")
+
+
+def file_sha256(file_path, block_size=BLOCK_SIZE):
+    # Compressed files are hashed by their content, so a rotated log keeps
+    # its hash when logrotate compresses it.
+    file_hash = hashlib.sha256()
+    with logfamily.open_log(file_path) as f:
+        for block in read_blocks(f, block_size):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def range_sha256(f, end):
+    start = max(0, end - TAIL_HASH_BYTES)
+    f.seek(start)
+    return hashlib.sha256(f.read(end - start)).hexdigest()
+
+
+def last_line_end(f, size, block_size=BLOCK_SIZE):
+    """Return the offset just past the last newline before size, or 0."""
+    pos = size
+    while pos > 0:
+        start = max(0, pos - block_size)
+        f.seek(start)
+        cut = f.read(pos - start).rfind(b"\n")
+        if cut != -1:
+            return start + cut + 1
+        pos = start
+    return 0
+
+
+def read_range(f, end, block_size=BLOCK_SIZE):
+    """Yield raw blocks from the current position up to end."""
+    remaining = end - f.tell()
+    while remaining > 0:
+        block = f.read(min(block_size, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+
+def align_lines(blocks):
+    """Re-cut a stream of byte blocks on line boundaries.
+
+    Every piece except possibly the last ends on a newline, so no log line is
+    ever split across two pieces.
+    """
+    pending = b""
+    for block in blocks:
+        cut = block.rfind(b"\n") + 1
+        if cut:
+            yield pending + block[:cut]
+            pending = block[cut:]
+        else:
+            pending += block
+    if pending:
+        yield pending
+
+
+def split_lines(blocks, offset=0, line_no=1):
+    """Yield (line_no, byte_offset, text) for each line in a stream of byte blocks."""
+    for raw in align_lines(blocks):
+        start = 0
+        while start < len(raw):
+            stop = raw.find(b"\n", start) + 1 or len(raw)
+            text = raw[start:stop].decode("utf-8", errors="replace")
+            yield line_no, offset + start, text.rstrip("\r\n")
+            line_no += 1
+            start = stop
+        offset += len(raw)
+
+
+def iter_lines(f, end, line_no=1, block_size=BLOCK_SIZE):
+    """Yield (line_no, byte_offset, text) for each line up to end."""
+    return split_lines(read_range(f, end, block_size), f.tell(), line_no)
+
+
+def chunk_id(metadata, offset):
+    source = ":".join(
+        str(metadata.get(key, "")) for key in ("filepath", "file_hash", "generation")
+    )
+    # Templates and chunks of the same lines may share a store.
+    if metadata.get("kind", "chunk") != "chunk":
+        source += f":{metadata['kind']}"
+    return hashlib.sha256(f"{source}:{offset}".encode("utf-8")).hexdigest()
+
+
+def iter_splits(lines, metadata, chunker, position=None):
+    # Ids are derived from the source position so that re-running an
+    # interrupted ingest upserts the same chunks instead of duplicating them.
+    for doc in chunker.split(lines, metadata):
+        doc.id = chunk_id(doc.metadata, doc.metadata["offset"])
+        if position is not None:
+            # Template documents are not emitted in line order.
+            position["line"] = max(position["line"], doc.metadata["line_end"] + 1)
+        yield doc
+
+
+def add_documents_batched(
+    vector_store, documents, batch_size=BATCH_SIZE, lexical_index=None, catalog=None
+):
+    count = 0
+    for batch in itertools.batched(documents, batch_size):
+        doc_ids = vector_store.add_documents(documents=list(batch))
+        if lexical_index is not None:
+            lexical_index.add_documents(batch)
+        if catalog is not None:
+            catalog.add_documents(batch)
+        count += len(doc_ids)
+        logger.debug(f"Flushed {len(doc_ids)} documents to the vector store")
+    return count
+
+
+def indexed_hashes(file_hashes, vector_store, kind, catalog=None):
+    """Return which of file_hashes are already indexed as documents of kind.
+
+    With a catalog.CorpusCatalog this is a single lookup; otherwise the
+    vector store is asked once per hash.
+    """
+    if catalog is not None:
+        return catalog.indexed_hashes(file_hashes, kind)
+    if kind == "chunk":
+        # Chunks from before kinds existed have no kind; $ne matches those.
+        kind_clause = {"kind": {"$ne": "template"}}
+    else:
+        kind_clause = {"kind": kind}
+    found = set()
+    for file_hash in set(file_hashes):
+        where = {"$and": [{"file_hash": file_hash}, kind_clause]}
+        existing_docs = vector_store.get(where=where, include=["metadatas"], limit=1)
+        if existing_docs and existing_docs.get("metadatas"):
+            found.add(file_hash)
+    return found
+
+
+def ingest_whole_file(
+    file_path,
+    file_hash,
+    vector_store,
+    chunker,
+    block_size,
+    batch_size,
+    lexical_index=None,
+    catalog=None,
+):
+    logger.info(f"File {file_path} will be indexed")
+    md = {
+        "filepath": file_path,
+        "file_hash": file_hash,
+    }
+    with logfamily.open_log(file_path) as f:
+        lines = split_lines(read_blocks(f, block_size))
+        splits = iter_splits(lines, md, chunker)
+        count = add_documents_batched(
+            vector_store, splits, batch_size, lexical_index, catalog
+        )
+    if catalog is not None:
+        catalog.finish_file(file_path, file_hash, chunker.kind)
+    return count
+
+
+def split_file(file_path, file_hash, chunker, pieces, block_size=BLOCK_SIZE):
+    """Chunk a whole, possibly compressed, file. Runs in ingest_archives workers.
+
+    Documents are put on the pieces queue in lists covering about PIECE_LINES
+    lines, followed by None once the file is done.
+    """
+    md = {
+        "filepath": file_path,
+        "file_hash": file_hash,
+    }
+    try:
+        with logfamily.open_log(file_path) as f:
+            lines = split_lines(read_blocks(f, block_size))
+            piece, piece_start = [], 1
+            for doc in iter_splits(lines, md, chunker):
+                piece.append(doc)
+                if doc.metadata["line_end"] - piece_start + 1 >= PIECE_LINES:
+                    pieces.put(piece)
+                    piece, piece_start = [], doc.metadata["line_end"] + 1
+            if piece:
+                pieces.put(piece)
+    finally:
+        pieces.put(None)
+
+
+def iter_pieces(pieces, future):
+    """Yield the documents split_file puts on pieces, until it is done."""
+    while True:
+        try:
+            piece = pieces.get(timeout=1)
+        except queue.Empty:
+            # Raises if the worker failed before it could say it was done.
+            if future.done():
+                future.result()
+            continue
+        if piece is None:
+            break
+        yield from piece
+    # Raises if the worker failed part way through the file.
+    future.result()
+
+
+def ingest_archives(
+    file_paths,
+    vector_store,
+    chunker,
+    block_size,
+    batch_size,
+    lexical_index=None,
+    catalog=None,
+    max_workers=None,
+):
+    """Index immutable rotated logs, decompressing and chunking them in parallel.
+
+    Hashing and chunking run in a process pool; embedding and writes to the
+    vector store stay in this process, in the order of file_paths. Workers
+    hand documents over in bounded pieces, so at most max_workers files are
+    chunked ahead and memory does not grow with the size of the archives.
+    """
+    if not file_paths:
+        return 0
+    max_workers = max_workers or os.cpu_count() or 1
+    indexed = 0
+    # The parent has threads of its own (embedding, partitions), which fork
+    # does not mix with.
+    context = multiprocessing.get_context("spawn")
+    with (
+        context.Manager() as manager,
+        ProcessPoolExecutor(max_workers, mp_context=context) as pool,
+    ):
+        file_hashes = dict(
+            zip(
+                file_paths,
+                pool.map(file_sha256, file_paths, itertools.repeat(block_size)),
+            )
+        )
+        known = indexed_hashes(
+            file_hashes.values(), vector_store, chunker.kind, catalog
+        )
+        pending = collections.deque()
+        for file_path in file_paths:
+            file_hash = file_hashes[file_path]
+            if file_hash in known:
+                logger.info(f"Skipping ingestion for {file_path} with hash {file_hash}")
+                continue
+            known.add(file_hash)
+            logger.info(f"File {file_path} will be indexed")
+            pieces = manager.Queue(QUEUED_PIECES)
+            future = pool.submit(
+                split_file, file_path, file_hash, chunker, pieces, block_size
+            )
+            pending.append((file_path, file_hash, pieces, future))
+            while pending and (len(pending) > max_workers or pending[0][3].done()):
+                indexed += add_archive(
+                    *pending.popleft(),
+                    chunker.kind,
+                    vector_store,
+                    batch_size,
+                    lexical_index,
+                    catalog,
+                )
+        while pending:
+            indexed += add_archive(
+                *pending.popleft(),
+                chunker.kind,
+                vector_store,
+                batch_size,
+                lexical_index,
+                catalog,
+            )
+    return indexed
+
+
+def add_archive(
+    file_path,
+    file_hash,
+    pieces,
+    future,
+    kind,
+    vector_store,
+    batch_size,
+    lexical_index,
+    catalog,
+):
+    splits = iter_pieces(pieces, future)
+    count = add_documents_batched(
+        vector_store, splits, batch_size, lexical_index, catalog
+    )
+    if catalog is not None:
+        catalog.finish_file(file_path, file_hash, kind)
+    logger.debug(f"Indexed {count} documents from {file_path}")
+    return count
+
+
+def resume_point(f, stat, entry):
+    """Return (offset, line_no, generation) to continue ingesting a file."""
+    if entry is None:
+        return 0, 1, 0
+    offset = entry["offset"]
+    if (
+        stat.st_ino != entry["inode"]
+        or stat.st_size < offset
+        or range_sha256(f, offset) != entry["tail_hash"]
+    ):
+        generation = entry["generation"] + 1
+        logger.info(
+            f"{f.name} was rotated or truncated, starting generation {generation}"
+        )
+        return 0, 1, generation
+    return offset, entry["line"], entry["generation"]
+
+
+def ingest_appended(
+    file_path,
+    vector_store,
+    manifest,
+    chunker,
+    block_size,
+    batch_size,
+    lexical_index=None,
+    catalog=None,
+):
+    with open(file_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        entry = manifest.get(file_path)
+        if entry and (entry["inode"], entry["size"], entry["mtime"]) == (
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime,
+        ):
+            logger.info(f"Skipping ingestion for {file_path}, unchanged since last run")
+            return 0
+
+        start, line_no, generation = resume_point(f, stat, entry)
+        # A trailing line without a newline is still being written; leave it
+        # for the next run.
+        end = max(start, last_line_end(f, stat.st_size, block_size))
+        count = 0
+        if end > start:
+            logger.info(
+                f"File {file_path} will be indexed from byte {start} to {end} (generation {generation})"
+            )
+            md = {
+                "filepath": file_path,
+                "generation": generation,
+            }
+            f.seek(start)
+            position = {"line": line_no}
+            lines = iter_lines(f, end, line_no, block_size)
+            splits = iter_splits(lines, md, chunker, position)
+            count = add_documents_batched(
+                vector_store, splits, batch_size, lexical_index, catalog
+            )
+            line_no = position["line"]
+
+        manifest.update(
+            file_path,
+            inode=stat.st_ino,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            offset=end,
+            line=line_no,
+            tail_hash=range_sha256(f, end),
+            generation=generation,
+        )
+        manifest.save()
+        return count
+
+
+def ingest_rotated(
+    file_path,
+    base_path,
+    vector_store,
+    manifest,
+    chunker,
+    block_size,
+    batch_size,
+    lexical_index=None,
+    catalog=None,
+):
+    """Index a plain rotated log, such as syslog.1, using what the manifest knows.
+
+    If it is the file ingest was following as base_path before the last
+    rotation, only the lines past the manifest offset are indexed, as the
+    tail of that generation of base_path. Returns None when the manifest
+    knows nothing about the file.
+    """
+    with open(file_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        seen = manifest.get(file_path)
+        if seen and (seen["inode"], seen["size"]) == (stat.st_ino, stat.st_size):
+            logger.info(f"Skipping ingestion for {file_path}, unchanged since last run")
+            return 0
+        entry = manifest.get(base_path)
+        if entry is None or entry["inode"] != stat.st_ino:
+            return None
+        start, line_no, generation = resume_point(f, stat, entry)
+        if generation != entry["generation"]:
+            return None
+
+        count = 0
+        if stat.st_size > start:
+            logger.info(
+                f"File {file_path} was rotated from {base_path}, indexing from byte {start} (generation {generation})"
+            )
+            md = {
+                "filepath": base_path,
+                "generation": generation,
+            }
+            f.seek(start)
+            position = {"line": line_no}
+            # The file is closed for writing now, so its last line is complete
+            # even without a newline.
+            lines = iter_lines(f, stat.st_size, line_no, block_size)
+            splits = iter_splits(lines, md, chunker, position)
+            count = add_documents_batched(
+                vector_store, splits, batch_size, lexical_index, catalog
+            )
+            line_no = position["line"]
+
+        manifest.update(
+            file_path,
+            inode=stat.st_ino,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            offset=stat.st_size,
+            line=line_no,
+            tail_hash=range_sha256(f, stat.st_size),
+            generation=generation,
+        )
+        manifest.save()
+    if catalog is not None:
+        # Lets the catalog recognise the file once logrotate compresses it.
+        catalog.finish_file(file_path, file_sha256(file_path, block_size), chunker.kind)
+    return count
+
+
+def ingest_family(
+    base_path,
+    vector_store,
+    manifest=None,
+    block_size=BLOCK_SIZE,
+    batch_size=BATCH_SIZE,
+    lexical_index=None,
+    chunker=None,
+    catalog=None,
+    max_workers=None,
+):
+    """Index a log together with its logrotate generations, oldest first.
+
+    logfamily.discover finds syslog.1, syslog.2.gz and so on next to
+    base_path. Rotated files are immutable: they are deduplicated by content
+    hash and decompressed and chunked in parallel by ingest_archives. With a
+    manifest, a plain syslog.1 that was being followed as base_path before
+    the last rotation is finished from where ingest stopped, and base_path
+    itself is then indexed incrementally. Pass a catalog as well so that
+    this file is still recognised once it is compressed into syslog.2.gz.
+    """
+    chunker = chunker or chunking.LogChunker()
+    indexed = 0
+    archives = []
+    for file_path in logfamily.discover(base_path):
+        if file_path == base_path:
+            continue
+        count = None
+        if manifest is not None and logfamily.compression(file_path) is None:
+            count = ingest_rotated(
+                file_path,
+                base_path,
+                vector_store,
+                manifest,
+                chunker,
+                block_size,
+                batch_size,
+                lexical_index,
+                catalog,
+            )
+        if count is None:
+            archives.append(file_path)
+        else:
+            indexed += count
+    indexed += ingest_archives(
+        archives,
+        vector_store,
+        chunker,
+        block_size,
+        batch_size,
+        lexical_index,
+        catalog,
+        max_workers,
+    )
+    if os.path.exists(base_path):
+        indexed += ingest_files(
+            [base_path],
+            vector_store,
+            manifest,
+            block_size,
+            batch_size,
+            lexical_index,
+            chunker,
+            catalog,
+        )
+    return indexed
+
+
+def ingest_stream(
+    blocks,
+    vector_store,
+    metadata,
+    offset=0,
+    line_no=1,
+    batch_size=BATCH_SIZE,
+    lexical_index=None,
+    chunker=None,
+    catalog=None,
+):
+    """Index a stream of byte blocks, such as SSHClient.stream, without a file.
+
+    offset and line_no give the position of the first block in the source log
+    and are used for chunk ids and line metadata.
+    """
+    chunker = chunker or chunking.LogChunker()
+    lines = split_lines(blocks, offset, line_no)
+    splits = iter_splits(lines, metadata, chunker)
+    count = add_documents_batched(
+        vector_store, splits, batch_size, lexical_index, catalog
+    )
+    logger.info(f"Indexed {count} documents from {metadata['filepath']}")
+    return count
+
+
+def ingest_files(
+    file_paths,
+    vector_store,
+    manifest=None,
+    block_size=BLOCK_SIZE,
+    batch_size=BATCH_SIZE,
+    lexical_index=None,
+    chunker=None,
+    catalog=None,
+):
+    """Index log files into vector_store.
+
+    Without a manifest each file is deduplicated by its full content hash. With
+    a manifest.IngestManifest only bytes appended since the previous
+    run are indexed. If lexical_index is given every chunk is added to it too.
+    chunker defaults to chunking.LogChunker; pass a templates.TemplateChunker
+    to index one document per log template and time window instead. A
+    manifest records progress for one chunker, so use a separate manifest per
+    kind of document. A catalog.CorpusCatalog, if given, is updated with every
+    batch and answers the whole-file dedup check for all files at once.
+    """
+    chunker = chunker or chunking.LogChunker()
+    indexed = 0
+    if manifest is None:
+        file_hashes = {
+            file_path: file_sha256(file_path, block_size) for file_path in file_paths
+        }
+        known = indexed_hashes(
+            file_hashes.values(), vector_store, chunker.kind, catalog
+        )
     for file_path in file_paths:
-        with open(file_path, "r") as f:
-            logger.info(f"Ingesting file {f.name}")
-            file_content = f.read()
-            file_hash = hashlib.sha256(file_content.encode("utf-8")).hexdigest()
-
-            existing_docs = vector_store.get(
-                where={"file_hash": file_hash}, include=["metadatas"]
-            )
-            if existing_docs and existing_docs.get("metadatas"):
-                logger.info(f"Skipping ingestion for {f.name} with hash {file_hash}")
-            else:
-                md = {
-                    "filepath": file_path,
-                    "file_hash": file_hash,
-                }
-                docs.append(Document(page_content=file_content, metadata=md))
-                logger.info(f"File {f.name} will be indexed")
-
-    if docs:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200
-        )
-        all_splits = text_splitter.split_documents(docs)
-        doc_ids = vector_store.add_documents(documents=all_splits)
-        logger.info(f"Indexed {len(doc_ids)} documents into the vector store")
+        logger.info(f"Ingesting file {file_path}")
+        if manifest is None:
+            file_hash = file_hashes[file_path]
+            if file_hash in known:
+                logger.info(f"Skipping ingestion for {file_path} with hash {file_hash}")
+                continue
+            # The same content may appear twice in one call.
+            known.add(file_hash)
+            indexed += ingest_whole_file(
+                file_path,
+                file_hash,
+                vector_store,
+                chunker,
+                block_size,
+                batch_size,
+                lexical_index,
+                catalog,
+            )
+        else:
+            indexed += ingest_appended(
+                file_path,
+                vector_store,
+                manifest,
+                chunker,
+                block_size,
+                batch_size,
+                lexical_index,
+                catalog,
+            )
+
+    if indexed:
+        logger.info(f"Indexed {indexed} documents into the vector store")
     else:
         logger.info("No new documents to index")
+    return indexed
@@ -0,0 +1,207 @@
+from collections import Counter
+from langchain_core.documents import Document
+from logs_langchain import scope
+from typing import List, Optional
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r"[\w.:@/-]+")
+SEPARATORS = re.compile(r"[.:@/-]+")
+# Tokens that look like identifiers rather than words: IPs, PIDs, unit names,
+# paths, container names with digits or dashes.
+EXACT = re.compile(r"\d|[.:@/_-]\w")
+STOPWORDS = frozenset(
+    """a about all an and any are as at be been but by can did do does for from
+    had has have how i if in is it its me my of on or show tell that the their
+    there these this to was were what when where which who why will with you
+    your""".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase tokens, keeping compound tokens whole and also their parts."""
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        token = token.strip(".:@/-")
+        if not token:
+            continue
+        tokens.append(token)
+        parts = SEPARATORS.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def reciprocal_rank_fusion(result_lists, k: int = 60) -> List[Document]:
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class BM25Index:
+    """On-disk BM25 inverted index over log chunks, stored in SQLite."""
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75) -> None:
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                length INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats VALUES ('docs', 0), ('length', 0);
+            """
+        )
+
+    def _remove(self, doc_id: str) -> None:
+        row = self.db.execute(
+            "SELECT length FROM docs WHERE id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            return
+        self.db.execute(
+            "UPDATE terms SET df = df - 1 WHERE term IN (SELECT term FROM postings WHERE doc_id = ?)",
+            (doc_id,),
+        )
+        self.db.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+        self.db.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+        self.db.execute("UPDATE stats SET value = value - 1 WHERE name = 'docs'")
+        self.db.execute(
+            "UPDATE stats SET value = value - ? WHERE name = 'length'", (row[0],)
+        )
+
+    def add_documents(self, documents: List[Document]) -> None:
+        with self.lock, self.db:
+            for doc in documents:
+                self._remove(doc.id)
+                counts = Counter(tokenize(doc.page_content))
+                length = sum(counts.values())
+                self.db.execute(
+                    "INSERT INTO docs VALUES (?, ?, ?, ?)",
+                    (doc.id, length, doc.page_content, json.dumps(doc.metadata)),
+                )
+                self.db.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, doc.id, tf) for term, tf in counts.items()],
+                )
+                self.db.executemany(
+                    "INSERT INTO terms VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in counts],
+                )
+                self.db.execute(
+                    "UPDATE stats SET value = value + 1 WHERE name = 'docs'"
+                )
+                self.db.execute(
+                    "UPDATE stats SET value = value + ? WHERE name = 'length'",
+                    (length,),
+                )
+        logger.debug(f"Added {len(documents)} documents to the lexical index")
+
+    def stats(self):
+        rows = dict(self.db.execute("SELECT name, value FROM stats").fetchall())
+        return rows["docs"], rows["length"]
+
+    def document_frequency(self, term: str) -> int:
+        row = self.db.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+        return row[0] if row else 0
+
+    def search(
+        self, query: str, k: int = 4, where: Optional[dict] = None
+    ) -> List[Document]:
+        terms = [term for term in set(tokenize(query)) if term not in STOPWORDS]
+        with self.lock:
+            n_docs, total_length = self.stats()
+            if not terms or not n_docs:
+                return []
+            avg_length = total_length / n_docs
+            scores = Counter()
+            for term in terms:
+                df = self.document_frequency(term)
+                if not df:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                rows = self.db.execute(
+                    "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id WHERE p.term = ?",
+                    (term,),
+                )
+                for doc_id, tf, length in rows:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            results = []
+            for doc_id, _ in scores.most_common():
+                content, metadata = self.db.execute(
+                    "SELECT content, metadata FROM docs WHERE id = ?", (doc_id,)
+                ).fetchone()
+                metadata = json.loads(metadata)
+                if where and not scope.matches(metadata, where):
+                    continue
+                results.append(
+                    Document(id=doc_id, page_content=content, metadata=metadata)
+                )
+                if len(results) == k:
+                    break
+        return results
+
+    def exact_terms(self, query: str) -> List[str]:
+        """Query terms that identify something specific rather than a topic.
+
+        These are identifier-shaped tokens (IPs, PIDs, unit and container names
+        with digits or separators) and words that are rare in the corpus.
+        """
+        n_docs, _ = self.stats()
+        rare = max(4, n_docs // 100)
+        terms = set()
+        for term in TOKEN.findall(query.lower()):
+            term = term.strip(".:@/-")
+            if not term or term in STOPWORDS:
+                continue
+            if EXACT.search(term) or 0 < self.document_frequency(term) <= rare:
+                terms.add(term)
+        return sorted(terms)
+
+    def answers_exactly(self, query: str, docs: List[Document], k: int = 4) -> bool:
+        """True if query hinges on exact terms and all k hits contain every one.
+
+        In that case a vector search is unlikely to add anything and retrieval
+        can skip embedding the query.
+        """
+        terms = self.exact_terms(query)
+        if not terms or len(docs) < k:
+            return False
+        return all(set(terms) <= set(tokenize(doc.page_content)) for doc in docs[:k])
@@ -0,0 +1,82 @@
+from typing import BinaryIO, List, Optional
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# logrotate names: syslog.1, syslog.2.gz, ... or with dateext syslog-20250101.gz
+MEMBER = re.compile(
+    r"(?:\.(?P<number>\d+)|-(?P<date>\d{8,10}))?(?P<ext>\.gz|\.bz2|\.xz|\.zst)?"
+)
+COMPRESSIONS = (".gz", ".bz2", ".xz", ".zst")
+
+
+def compression(path: str) -> Optional[str]:
+    """Return the compression extension of path, or None for a plain file."""
+    for ext in COMPRESSIONS:
+        if path.endswith(ext):
+            return ext
+    return None
+
+
+def open_zstd(path: str) -> BinaryIO:
+    try:
+        # Python 3.14 and later
+        from compression import zstd
+
+        return zstd.open(path, "rb")
+    except ImportError:
+        import zstandard
+
+        # Rotated logs may hold several concatenated frames.
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+        return io.BufferedReader(reader)
+
+
+def open_log(path: str) -> BinaryIO:
+    """Open a log for binary reading, decompressing it on the fly if needed."""
+    ext = compression(path)
+    if ext == ".gz":
+        return gzip.open(path, "rb")
+    if ext == ".bz2":
+        return bz2.open(path, "rb")
+    if ext == ".xz":
+        return lzma.open(path, "rb")
+    if ext == ".zst":
+        return open_zstd(path)
+    return open(path, "rb")
+
+
+def age(match: re.Match):
+    """Sort key putting older members first and the live file last."""
+    if match["date"]:
+        return (0, int(match["date"]))
+    if match["number"]:
+        return (1, -int(match["number"]))
+    return (2, 0)
+
+
+def discover(base_path: str) -> List[str]:
+    """Return the rotated generations of base_path and base_path itself, oldest first.
+
+    base_path need not exist any more; only files next to it whose names are
+    base_path plus a logrotate suffix are considered part of the family.
+    """
+    directory, name = os.path.split(base_path)
+    members = []
+    for entry in os.scandir(directory or "."):
+        if not entry.name.startswith(name) or not entry.is_file():
+            continue
+        match = MEMBER.fullmatch(entry.name, len(name))
+        if match:
+            members.append((age(match), os.path.join(directory, entry.name)))
+    members.sort()
+    logger.debug(f"Found {len(members)} files in the {base_path} family")
+    return [path for _, path in members]
@@ -1,3 +1,4 @@
+import mmap
 import os
 import logging
 from logs_langchain import factory
@@ -9,14 +10,101 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(mess
 
 LOG_FILE = "/var/log/syslog"  # Path to the log file
 LINES_TO_FETCH = 100
+BLOCK_SIZE = 64 * 1024
 
 
-def tail(filename, n):
+def line_start_offset(f, n, start, end, block_size=BLOCK_SIZE):
+    """Return the offset of the n-th last line in f[start:end], reading backwards.
+
+    A newline as the very last byte terminates the final line rather than
+    starting a new one, so it is not counted.
+    """
+    pos = end - 1
+    found = 0
+    while pos > start:
+        block_start = max(start, pos - block_size)
+        f.seek(block_start)
+        block = f.read(pos - block_start)
+        idx = len(block)
+        while (idx := block.rfind(b"\n", 0, idx)) != -1:
+            found += 1
+            if found == n:
+                return block_start + idx + 1
+        pos = block_start
+    return start
+
+
+def complete_lines_end(f, start, end, block_size=BLOCK_SIZE):
+    """Return the offset just past the last newline in f[start:end], or start."""
+    pos = end
+    while pos > start:
+        block_start = max(start, pos - block_size)
+        f.seek(block_start)
+        idx = f.read(pos - block_start).rfind(b"\n")
+        if idx != -1:
+            return block_start + idx + 1
+        pos = block_start
+    return start
+
+
+def mmap_line_start_offset(mm, n, start, end):
+    pos = end - 1
+    for _ in range(n):
+        idx = mm.rfind(b"\n", start, pos)
+        if idx == -1:
+            return start
+        pos = idx
+    return pos + 1
+
+
+def read_tail(f, n, start, end, use_mmap=False, block_size=BLOCK_SIZE):
+    if n <= 0 or end <= start:
+        return b""
+    if use_mmap:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[mmap_line_start_offset(mm, n, start, end) : end]
+    f.seek(line_start_offset(f, n, start, end, block_size))
+    return f.read(end - f.tell())
+
+
+def tail(filename, n, use_mmap=False, encoding="utf-8", block_size=BLOCK_SIZE):
+    """Return the last n lines of filename.
+
+    Reads backwards from EOF so the cost depends on n, not the file size.
+    Lines are found by their newline byte, so encoding must be ASCII
+    compatible (UTF-8, Latin-1, ...); undecodable bytes are replaced.
+    """
     logging.debug(f"Fetching last {n} lines from {filename}")
-    with open(filename, "r", encoding="utf-8", errors="replace") as f:
-        lines = f.readlines()
-    result = "".join(lines[-n:])
-    return result
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        data = read_tail(f, n, 0, size, use_mmap, block_size)
+    return data.decode(encoding, errors="replace")
+
+
+def tail_since(
+    filename, offset, n=None, use_mmap=False, encoding="utf-8", block_size=BLOCK_SIZE
+):
+    """Return (text, offset) with the complete lines written after offset.
+
+    Pass the returned offset back in to get only new lines on the next call. A
+    partial last line is left for the next call. If the file shrank (rotated or
+    truncated) reading restarts from the beginning. n limits the result to the
+    last n new lines.
+    """
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset > size:
+            logging.info(f"{filename} shrank below offset {offset}, reading from start")
+            offset = 0
+        end = complete_lines_end(f, offset, size, block_size)
+        if end <= offset:
+            return "", offset
+        if n is None:
+            f.seek(offset)
+            data = f.read(end - offset)
+        else:
+            data = read_tail(f, n, offset, end, use_mmap, block_size)
+    return data.decode(encoding, errors="replace"), end
 
 
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+import json
+import re
+
+# Syslog severities, most to least severe. The index is the numeric level.
+SEVERITIES = ("emerg", "alert", "crit", "err", "warning", "notice", "info", "debug")
+
+RFC3164 = re.compile(
+    r"^(?:<(?P<pri>\d{1,3})>)?(?P<ts>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) "
+    r"(?P<host>\S+) (?P<program>[^:\[\s]+)(?:\[(?P<pid>\d+)\])?: ?(?P<message>.*)$"
+)
+RFC5424 = re.compile(
+    r"^<(?P<pri>\d{1,3})>1 (?P<ts>\S+) (?P<host>\S+) (?P<program>\S+) "
+    r"(?P<pid>\S+) (?P<msgid>\S+) (?P<sd>-|(?:\[.*?\])+) ?(?P<message>.*)$"
+)
+# rsyslog high precision format and journalctl -o short-iso
+ISO_SYSLOG = re.compile(
+    r"^(?P<ts>\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d)?) "
+    r"(?P<host>\S+) (?P<program>[^:\[\s]+)(?:\[(?P<pid>\d+)\])?: ?(?P<message>.*)$"
+)
+# docker logs -t and most application logs: a timestamp followed by anything
+ISO_PREFIX = re.compile(
+    r"^(?P<ts>\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d)?)\s+(?P<message>.*)$"
+)
+SEVERITY_WORDS = re.compile(
+    r"\b(emerg(?:ency)?|panic|alert|crit(?:ical)?|fatal|err(?:or)?|fail(?:ed|ure)?|"
+    r"warn(?:ing)?|notice|info|debug)\b",
+    re.IGNORECASE,
+)
+SEVERITY_ALIASES = {
+    "emergency": "emerg",
+    "panic": "emerg",
+    "critical": "crit",
+    "fatal": "crit",
+    "error": "err",
+    "fail": "err",
+    "failed": "err",
+    "failure": "err",
+    "warn": "warning",
+}
+
+
+class LogRecord(NamedTuple):
+    ts: Optional[float]
+    host: Optional[str]
+    program: Optional[str]
+    pid: Optional[int]
+    severity: str
+    message: str
+
+
+def parse_iso(text: str) -> Optional[float]:
+    text = text.replace(",", ".").replace(" ", "T", 1)
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    # datetime only accepts up to microseconds
+    text = re.sub(r"(\.\d{6})\d+", r"\1", text)
+    try:
+        dt = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return dt.timestamp()
+
+
+def format_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts).isoformat(sep=" ", timespec="seconds")
+
+
+def parse_rfc3164_time(text: str, now: Optional[datetime] = None) -> Optional[float]:
+    # The classic BSD format has no year: assume the current one, unless that
+    # would put the line in the future (a December log read in January).
+    now = now or datetime.now()
+    try:
+        dt = datetime.strptime(f"{now.year} {text}", "%Y %b %d %H:%M:%S")
+    except ValueError:
+        return None
+    if (dt - now).days > 1:
+        try:
+            dt = dt.replace(year=now.year - 1)
+        except ValueError:
+            # Feb 29 read early in the following leap year; last year had none.
+            return None
+    return dt.timestamp()
+
+
+def severity_from_text(message: str) -> str:
+    match = SEVERITY_WORDS.search(message)
+    if not match:
+        return "info"
+    word = match.group(1).lower()
+    return SEVERITY_ALIASES.get(word, word)
+
+
+def severity_from_pri(pri: Optional[str], message: str) -> str:
+    if pri is None:
+        return severity_from_text(message)
+    return SEVERITIES[int(pri) & 7]
+
+
+def parse_pid(pid: Optional[str]) -> Optional[int]:
+    return int(pid) if pid and pid.isdigit() else None
+
+
+def parse_int(value) -> Optional[int]:
+    """Return a JSON number or string of digits as an int, otherwise None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdecimal():
+        return int(value)
+    return None
+
+
+def optional_str(data: dict, *keys: str) -> Optional[str]:
+    for key in keys:
+        value = data.get(key)
+        if value and isinstance(value, str):
+            return value
+    return None
+
+
+def parse_json(line: str) -> Optional[LogRecord]:
+    """Parse a journalctl -o json or docker json-file line.
+
+    Returns None for anything else, including records whose fields do not have
+    the expected types, so the caller treats the line as plain text.
+    """
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if "__REALTIME_TIMESTAMP" in data or "MESSAGE" in data:
+        # journalctl -o json
+        message = data.get("MESSAGE") or ""
+        if isinstance(message, list):
+            if not all(isinstance(b, int) and 0 <= b < 256 for b in message):
+                return None
+            message = bytes(message).decode("utf-8", errors="replace")
+        if not isinstance(message, str):
+            return None
+        realtime = data.get("__REALTIME_TIMESTAMP")
+        ts = parse_int(realtime)
+        if realtime is not None and ts is None:
+            return None
+        priority = data.get("PRIORITY")
+        level = parse_int(priority)
+        if priority is not None and level not in range(len(SEVERITIES)):
+            return None
+        return LogRecord(
+            ts=ts / 1e6 if ts else None,
+            host=optional_str(data, "_HOSTNAME"),
+            program=optional_str(data, "_SYSTEMD_UNIT", "SYSLOG_IDENTIFIER"),
+            pid=parse_int(data.get("_PID")),
+            severity=(
+                SEVERITIES[level] if level is not None else severity_from_text(message)
+            ),
+            message=message,
+        )
+    if "log" in data:
+        # docker json-file driver
+        if not isinstance(data["log"], str):
+            return None
+        message = data["log"].rstrip("\n")
+        time = optional_str(data, "time")
+        return LogRecord(
+            ts=parse_iso(time) if time else None,
+            host=None,
+            program=None,
+            pid=None,
+            severity=severity_from_text(message),
+            message=message,
+        )
+    return None
+
+
+def parse_line(line: str, now: Optional[datetime] = None) -> LogRecord:
+    """Best-effort parse of one syslog, journald or docker log line."""
+    if line.startswith("{"):
+        record = parse_json(line)
+        if record is not None:
+            return record
+
+    match = RFC3164.match(line)
+    if match:
+        return LogRecord(
+            ts=parse_rfc3164_time(match["ts"], now),
+            host=match["host"],
+            program=match["program"],
+            pid=parse_pid(match["pid"]),
+            severity=severity_from_pri(match["pri"], match["message"]),
+            message=match["message"],
+        )
+
+    match = RFC5424.match(line)
+    if match:
+        return LogRecord(
+            ts=parse_iso(match["ts"]),
+            host=None if match["host"] == "-" else match["host"],
+            program=None if match["program"] == "-" else match["program"],
+            pid=parse_pid(match["pid"]),
+            severity=severity_from_pri(match["pri"], match["message"]),
+            message=match["message"],
+        )
+
+    match = ISO_SYSLOG.match(line)
+    if match:
+        ts = parse_iso(match["ts"])
+        if ts is not None:
+            return LogRecord(
+                ts=ts,
+                host=match["host"],
+                program=match["program"],
+                pid=parse_pid(match["pid"]),
+                severity=severity_from_text(match["message"]),
+                message=match["message"],
+            )
+
+    match = ISO_PREFIX.match(line)
+    if match:
+        ts = parse_iso(match["ts"])
+        if ts is not None:
+            return LogRecord(
+                ts=ts,
+                host=None,
+                program=None,
+                pid=None,
+                severity=severity_from_text(match["message"]),
+                message=match["message"],
+            )
+
+    return LogRecord(None, None, None, None, severity_from_text(line), line)
@@ -1,8 +1,18 @@
-from langchain import hub
 from langgraph.graph import START, StateGraph
-from logs_langchain import factory, ingest
+from logs_langchain import (
+    catalog,
+    context,
+    factory,
+    hosts,
+    ingest,
+    lexical,
+    logparse,
+    logstore,
+    manifest,
+    scope,
+)
 import logging
-from typing_extensions import List, TypedDict
+from typing_extensions import List, NotRequired, Optional, TypedDict
 from langchain_core.documents import Document
 
 logger = logging.getLogger(__name__)
@@ -12,21 +22,75 @@ class State(TypedDict):
     question: str
     context: List[Document]
     answer: str
+    # Optional retrieval scope. When absent it is extracted from the question.
+    start: NotRequired[Optional[float]]
+    end: NotRequired[Optional[float]]
+    hosts: NotRequired[Optional[List[str]]]
+    # "chunk" or "template" to retrieve only that kind of document.
+    kind: NotRequired[Optional[str]]
 
 
 class RAGGraph:
-    def __init__(self, prompt, llm, vector_store):
+    def __init__(
+        self,
+        prompt,
+        llm,
+        vector_store,
+        known_hosts=None,
+        lexical_index=None,
+        k=4,
+        context_tokens=4000,
+    ):
         self.prompt = prompt
         self.llm = llm
         self.vector_store = vector_store
+        self.known_hosts = list(known_hosts or hosts.HOSTS)
+        self.lexical_index = lexical_index
+        self.k = k
+        self.context_tokens = context_tokens
         self.compiled = self.make_graph()
 
+    def retrieval_filter(self, state: State, use_kind: bool = True):
+        if "start" in state or "end" in state:
+            start, end = state.get("start"), state.get("end")
+        else:
+            start, end = scope.extract_time_range(state["question"])
+        if "hosts" in state:
+            host_names = state["hosts"]
+        else:
+            host_names = scope.extract_hosts(state["question"], self.known_hosts)
+        kind = None
+        if use_kind:
+            kind = state.get("kind", scope.extract_kind(state["question"]))
+        return scope.metadata_filter(start, end, host_names, kind)
+
+    def search(self, question: str, where) -> List[Document]:
+        logger.debug(f"Retrieving with filter {where}")
+        lexical_docs = []
+        if self.lexical_index is not None:
+            lexical_docs = self.lexical_index.search(question, self.k, where)
+            if self.lexical_index.answers_exactly(question, lexical_docs, self.k):
+                logger.debug(
+                    "Lexical hits cover every exact term, skipping vector search"
+                )
+                return lexical_docs
+        vector_docs = self.vector_store.similarity_search(
+            question, k=self.k, filter=where
+        )
+        retrieved_docs = lexical.reciprocal_rank_fusion([vector_docs, lexical_docs])
+        return retrieved_docs[: self.k]
+
     def retrieve(self, state: State):
-        retrieved_docs = self.vector_store.similarity_search(state["question"])
-        return {"context": retrieved_docs}
+        question = state["question"]
+        docs = self.search(question, self.retrieval_filter(state))
+        if not docs and "kind" not in state and scope.extract_kind(question):
+            # The store may not have been indexed with templates.
+            logger.debug("No template documents matched, searching all documents")
+            docs = self.search(question, self.retrieval_filter(state, use_kind=False))
+        return {"context": docs}
 
     def generate(self, state: State):
-        docs_content = "\n\n".join(doc.page_content for doc in state["context"])
+        docs_content = context.pack_context(state["context"], self.context_tokens)
         messages = self.prompt.invoke(
             {"question": state["question"], "context": docs_content}
         )
@@ -39,34 +103,62 @@ class RAGGraph:
         return graph_builder.compile()
 
 
-def show_vector_store_statistics(vector_store):
-    all_docs = vector_store.get(include=["metadatas", "documents"])
+def show_vector_store_statistics(vector_store, corpus_catalog=None):
+    if corpus_catalog is not None:
+        files, documents, size = corpus_catalog.totals()
+        logger.info(
+            f"Found {files} unique filepaths across {documents} documents ({size} bytes) in the vector store."
+        )
+        for host, kind, count, size, ts_start, ts_end in corpus_catalog.hosts():
+            span = ""
+            if ts_start is not None:
+                span = f", {logparse.format_time(ts_start)} to {logparse.format_time(ts_end)}"
+            logger.info(f"  {host}: {count} {kind} documents, {size} bytes{span}")
+        return
+    # Without a catalog, read back metadata only; the text isn't needed.
+    all_docs = vector_store.get(include=["metadatas"])
     fp = set()
     for metadata in all_docs.get("metadatas", []):
         if metadata and "filepath" in metadata:
             fp.add(metadata["filepath"])
     logger.info(
-        f"Found {len(fp)} unique filepaths across {len(all_docs.get('documents', []))} documents in the vector store."
+        f"Found {len(fp)} unique filepaths across {len(all_docs.get('ids', []))} documents in the vector store."
     )
 
 
 if __name__ == "__main__":
+    from langchain import hub
+
     logging.basicConfig(level=logging.DEBUG)
 
     google_factory = factory.GoogleFactory()
     llm = google_factory.llm()
-    embeddings = google_factory.embeddings()
+    embeddings = google_factory.embeddings(
+        cache_path="./temp/embedding_cache.sqlite", schedule=True
+    )
     logger.info("LLM and embeddings initialized")
-    vector_store = factory.vector_store(
-        embeddings, persist_directory="./temp/chroma_logs_langchain"
+    # The manifest and BM25 index describe what is in the vector store, so
+    # they live next to it.
+    persist_directory = "./temp/chroma_logs_langchain_partitioned"
+    vector_store = factory.partitioned_vector_store(
+        embeddings, persist_directory=persist_directory
     )
 
-    ingest.ingest_files(["temp/syslog"], vector_store)
+    lexical_index = lexical.BM25Index(f"{persist_directory}/lograg_bm25.sqlite")
+    corpus_catalog = catalog.CorpusCatalog(f"{persist_directory}/lograg_catalog.sqlite")
+    ingest.ingest_family(
+        "temp/syslog",
+        vector_store,
+        manifest=manifest.IngestManifest(f"{persist_directory}/ingest_manifest.json"),
+        lexical_index=lexical_index,
+        catalog=corpus_catalog,
+    )
 
-    show_vector_store_statistics(vector_store)
+    show_vector_store_statistics(vector_store, corpus_catalog)
+    logstore.default_store().add_family("temp/syslog")
 
     prompt = hub.pull("rlm/rag-prompt")
-    graph = RAGGraph(prompt, llm, vector_store)
+    graph = RAGGraph(prompt, llm, vector_store, lexical_index=lexical_index)
     response = graph.compiled.invoke(
         {
             "question": "Summarize tailscale related lines. Also what are the log times of those related lines?"
@@ -75,3 +167,4 @@ if __name__ == "__main__":
     # print(response["context"])
     print("-------------")
     print(response["answer"])
+    logger.info(f"Embedding cache hits={embeddings.hits} misses={embeddings.misses}")
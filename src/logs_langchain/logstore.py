@@ -0,0 +1,470 @@
+from collections import Counter
+from datetime import datetime, timezone
+from langchain_core.documents import Document
+from logs_langchain import catalog, ingest, logparse, manifest
+from typing import Dict, Iterable, List, Optional, Sequence
+import functools
+import json
+import logging
+import numpy as np
+import os
+import re
+import shutil
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = "./temp/logstore"
+# Lines per RecordChunker document, and rows a segment is compacted up to.
+BLOCK_LINES = 8192
+SEGMENT_ROWS = 1 << 20
+# Time zone offsets only change on a quarter hour boundary, so one offset is
+# looked up per quarter hour of timestamps.
+OFFSET_STEP = 900
+# Columns that are stored dictionary encoded, as int32 codes into a list of
+# distinct values. -1 is a missing value.
+STRING_COLUMNS = ("host", "program")
+TIME_BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+TIME_FORMATS = {"minute": "%Y-%m-%d %H:%M", "hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}
+GROUP_COLUMNS = ("host", "program", "severity", "pid", *TIME_BUCKETS)
+MISSING = "-"
+PID_MAX = np.iinfo(np.int64).max
+SEGMENT = re.compile(r"segment-\d{8}")
+
+
+class RecordChunker:
+    """A chunker whose documents carry parsed LogRecords rather than text to embed.
+
+    Used with ingest.ingest_family and a LogStore in place of a vector store,
+    so that parsing runs in the ingest_archives process pool and the store
+    gets ingest's manifest, rotation handling and content hash dedup.
+    """
+
+    kind = "records"
+
+    def __init__(self, block_lines: int = BLOCK_LINES) -> None:
+        self.block_lines = block_lines
+
+    def make_document(self, lines, records, metadata) -> Document:
+        md = dict(metadata)
+        md["kind"] = self.kind
+        md["offset"] = lines[0][1]
+        md["line_start"] = lines[0][0]
+        md["line_end"] = lines[-1][0]
+        timestamps = [record.ts for record in records if record.ts is not None]
+        if timestamps:
+            md["ts_start"] = min(timestamps)
+            md["ts_end"] = max(timestamps)
+        hosts = [record.host for record in records if record.host]
+        if hosts:
+            md["host"] = hosts[0]
+        md["records"] = records
+        # The lines are only kept as parsed records; the catalog counts the
+        # size of the text they came from.
+        md["bytes"] = sum(len(text.encode("utf-8")) + 1 for _, _, text in lines)
+        return Document(page_content="", metadata=md)
+
+    def split(self, lines, metadata):
+        """Yield Documents of up to block_lines parsed lines."""
+        block, records = [], []
+        for line in lines:
+            block.append(line)
+            records.append(logparse.parse_line(line[2]))
+            if len(block) == self.block_lines:
+                yield self.make_document(block, records, metadata)
+                block, records = [], []
+        if block:
+            yield self.make_document(block, records, metadata)
+
+
+class Columns:
+    """Rows of a segment in memory, one list or array per column."""
+
+    def __init__(self, ts, host, program, pid, severity, message) -> None:
+        self.ts = np.asarray(ts, dtype=np.float64)
+        self.host = list(host)
+        self.program = list(program)
+        self.pid = np.asarray(pid, dtype=np.int64)
+        self.severity = np.asarray(severity, dtype=np.int8)
+        self.message = list(message)
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @classmethod
+    def from_records(cls, records: Sequence[logparse.LogRecord]) -> "Columns":
+        severity = {name: i for i, name in enumerate(logparse.SEVERITIES)}
+        return cls(
+            ts=[np.nan if r.ts is None else r.ts for r in records],
+            host=[r.host for r in records],
+            program=[r.program for r in records],
+            # Anything that is not a plausible pid is stored as missing.
+            pid=[
+                r.pid if r.pid is not None and 0 <= r.pid <= PID_MAX else -1
+                for r in records
+            ],
+            severity=[severity[r.severity] for r in records],
+            message=[r.message for r in records],
+        )
+
+    @classmethod
+    def concat(cls, parts: List["Columns"]) -> "Columns":
+        return cls(
+            ts=np.concatenate([part.ts for part in parts]),
+            host=[value for part in parts for value in part.host],
+            program=[value for part in parts for value in part.program],
+            pid=np.concatenate([part.pid for part in parts]),
+            severity=np.concatenate([part.severity for part in parts]),
+            message=[value for part in parts for value in part.message],
+        )
+
+
+def encode(values: List[Optional[str]]):
+    """Dictionary encode values into (int32 codes, list of distinct values)."""
+    distinct: Dict[str, int] = {}
+    codes = np.fromiter(
+        (
+            -1 if value is None else distinct.setdefault(value, len(distinct))
+            for value in values
+        ),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return codes, list(distinct)
+
+
+def local_time(ts: np.ndarray) -> np.ndarray:
+    """Shift UTC timestamps to local wall clock seconds, DST included.
+
+    Buckets of the result align with local midnight, and the UTC time of a
+    bucket start is its local time.
+    """
+    steps = np.floor(ts / OFFSET_STEP)
+    dated = ~np.isnan(steps)
+    unique, inverse = np.unique(steps[dated], return_inverse=True)
+    offsets = np.array(
+        [
+            datetime.fromtimestamp(step * OFFSET_STEP)
+            .astimezone()
+            .utcoffset()
+            .total_seconds()
+            for step in unique.tolist()
+        ],
+        dtype=np.float64,
+    )
+    shifted = np.array(ts, dtype=np.float64)
+    if len(unique):
+        shifted[dated] += offsets[inverse]
+    return shifted
+
+
+class Segment:
+    """One immutable directory of .npy columns, loaded as memory maps.
+
+    Columns are only read from disk when a query touches them, and the
+    meta.json time range lets queries skip a segment without opening it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.dictionaries: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def write(
+        path: str, columns: Columns, ids: Iterable[str] = (), replaces=()
+    ) -> "Segment":
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        def save(name, array):
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+
+        save("ts", columns.ts)
+        save("pid", columns.pid)
+        save("severity", columns.severity)
+        for name in STRING_COLUMNS:
+            codes, values = encode(getattr(columns, name))
+            save(name, codes)
+            with open(os.path.join(tmp_path, f"{name}.json"), "w") as f:
+                json.dump(values, f)
+        # Messages are one UTF-8 blob plus the offset where each one starts.
+        encoded = [message.encode("utf-8") for message in columns.message]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(message) for message in encoded], out=offsets[1:])
+        save("message_offsets", offsets)
+        with open(os.path.join(tmp_path, "message.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+
+        dated = columns.ts[~np.isnan(columns.ts)]
+        meta = {
+            "rows": len(columns),
+            "ts_start": float(dated.min()) if len(dated) else None,
+            "ts_end": float(dated.max()) if len(dated) else None,
+            "ids": list(ids),
+            # Segments merged into this one by LogStore.compact.
+            "replaces": list(replaces),
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        # A segment appears complete or not at all.
+        os.replace(tmp_path, path)
+        return Segment(path)
+
+    @property
+    def rows(self) -> int:
+        return self.meta["rows"]
+
+    @functools.cached_property
+    def ts(self) -> np.ndarray:
+        return self.column("ts")
+
+    def column(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def values(self, name: str) -> List[str]:
+        if name not in self.dictionaries:
+            with open(os.path.join(self.path, f"{name}.json"), "r") as f:
+                self.dictionaries[name] = json.load(f)
+        return self.dictionaries[name]
+
+    def messages(self, rows: np.ndarray) -> List[str]:
+        offsets = self.column("message_offsets")
+        if not len(rows) or not offsets[-1]:
+            return [""] * len(rows)
+        blob = np.memmap(os.path.join(self.path, "message.bin"), dtype=np.uint8)
+        return [
+            blob[offsets[row] : offsets[row + 1]].tobytes().decode("utf-8")
+            for row in rows
+        ]
+
+    def load(self) -> Columns:
+        def decode(name):
+            values = self.values(name)
+            return [None if code < 0 else values[code] for code in self.column(name)]
+
+        return Columns(
+            ts=np.array(self.ts),
+            host=decode("host"),
+            program=decode("program"),
+            pid=np.array(self.column("pid")),
+            severity=np.array(self.column("severity")),
+            message=self.messages(np.arange(self.rows)),
+        )
+
+    def overlaps(self, start: Optional[float], end: Optional[float]) -> bool:
+        if start is None and end is None:
+            return True
+        if self.meta["ts_start"] is None:
+            return False
+        return (start is None or self.meta["ts_end"] >= start) and (
+            end is None or self.meta["ts_start"] <= end
+        )
+
+    def codes(self, name: str, wanted: Iterable[str]) -> np.ndarray:
+        values = self.values(name)
+        return np.array([i for i, value in enumerate(values) if value in wanted])
+
+    def mask(self, start, end, hosts, programs, severity, contains) -> np.ndarray:
+        mask = np.ones(self.rows, dtype=bool)
+        if start is not None:
+            mask &= self.ts >= start
+        if end is not None:
+            mask &= self.ts <= end
+        for name, wanted in (("host", hosts), ("program", programs)):
+            if wanted:
+                mask &= np.isin(self.column(name), self.codes(name, wanted))
+        if severity is not None:
+            mask &= self.column("severity") <= logparse.SEVERITIES.index(severity)
+        if contains and mask.any():
+            rows = np.flatnonzero(mask)
+            needle = contains.lower()
+            found = [needle in message.lower() for message in self.messages(rows)]
+            mask[rows[~np.array(found, dtype=bool)]] = False
+        return mask
+
+    def key(self, name: str, mask: np.ndarray) -> np.ndarray:
+        if name in TIME_BUCKETS:
+            ts = local_time(self.ts[mask])
+            buckets = np.floor(ts / TIME_BUCKETS[name])
+            return np.where(np.isnan(ts), -1, buckets).astype(np.int64)
+        return np.asarray(self.column(name)[mask], dtype=np.int64)
+
+    def decode(self, name: str, value: int) -> str:
+        if value < 0:
+            return MISSING
+        if name in TIME_BUCKETS:
+            start = datetime.fromtimestamp(value * TIME_BUCKETS[name], timezone.utc)
+            return start.strftime(TIME_FORMATS[name])
+        if name == "severity":
+            return logparse.SEVERITIES[value]
+        if name == "pid":
+            return str(value)
+        return self.values(name)[value]
+
+
+class LogStore:
+    """Parsed log lines in a local columnar store, for counting and grouping.
+
+    The store is a directory of Segments. Each holds timestamp, host,
+    program (or systemd unit), pid, severity and message columns, with host
+    and program dictionary encoded. Filters and group-by counts run as
+    vectorised NumPy operations over memory mapped columns, so questions
+    like errors per program per hour never send raw lines to the LLM.
+
+    Logs are added through ingest.ingest_family with a RecordChunker, using
+    a manifest and a catalog.CorpusCatalog kept inside the store directory.
+    """
+
+    def __init__(self, path: str = STORE_PATH) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = manifest.IngestManifest(os.path.join(path, "manifest.json"))
+        self.catalog = catalog.CorpusCatalog(os.path.join(path, "catalog.sqlite"))
+        self.segments: List[Segment] = []
+        self.ids = set()
+        for name in sorted(os.listdir(path)):
+            if SEGMENT.fullmatch(name):
+                self.segments.append(Segment(os.path.join(path, name)))
+        # Finish a compaction that stopped before removing what it merged.
+        replaced = {name for s in self.segments for name in s.meta["replaces"]}
+        for segment in self.segments:
+            if os.path.basename(segment.path) in replaced:
+                shutil.rmtree(segment.path)
+        self.segments = [
+            s for s in self.segments if os.path.basename(s.path) not in replaced
+        ]
+        for segment in self.segments:
+            self.ids.update(segment.meta["ids"])
+        logger.info(
+            f"Opened log store {path} with {len(self.segments)} segments, {self.rows} rows"
+        )
+
+    @property
+    def rows(self) -> int:
+        return sum(segment.rows for segment in self.segments)
+
+    def next_path(self) -> str:
+        number = 0
+        if self.segments:
+            number = max(int(s.path.rsplit("-", 1)[1]) for s in self.segments) + 1
+        return os.path.join(self.path, f"segment-{number:08d}")
+
+    def add_documents(self, documents: List[Document], **kwargs) -> List[str]:
+        """Write the records of a batch of RecordChunker documents as one segment."""
+        documents = [doc for doc in documents if doc.id not in self.ids]
+        records = [record for doc in documents for record in doc.metadata["records"]]
+        if records:
+            ids = [doc.id for doc in documents]
+            columns = Columns.from_records(records)
+            self.segments.append(Segment.write(self.next_path(), columns, ids))
+            self.ids.update(ids)
+            logger.debug(f"Wrote a segment of {len(records)} log records")
+        return [doc.id for doc in documents]
+
+    def add_family(self, base_path: str, max_workers: Optional[int] = None) -> int:
+        """Parse a log and its rotated generations into the store."""
+        count = ingest.ingest_family(
+            base_path,
+            self,
+            manifest=self.manifest,
+            # One add_documents call, and so one segment, per SEGMENT_ROWS lines.
+            batch_size=SEGMENT_ROWS // BLOCK_LINES,
+            chunker=RecordChunker(),
+            catalog=self.catalog,
+            max_workers=max_workers,
+        )
+        self.compact()
+        return count
+
+    def compact(self, max_rows: int = SEGMENT_ROWS) -> None:
+        """Merge runs of small segments, such as those from incremental ingests."""
+        run: List[Segment] = []
+        merged: List[Segment] = []
+        for segment in list(self.segments) + [None]:
+            if segment is not None and (
+                sum(s.rows for s in run) + segment.rows <= max_rows
+            ):
+                run.append(segment)
+                continue
+            if len(run) > 1:
+                columns = Columns.concat([s.load() for s in run])
+                ids = [doc_id for s in run for doc_id in s.meta["ids"]]
+                names = [os.path.basename(s.path) for s in run]
+                path = self.next_path()
+                merged.append(Segment.write(path, columns, ids, replaces=names))
+                self.segments.append(merged[-1])
+                for s in run:
+                    shutil.rmtree(s.path)
+                logger.debug(f"Compacted {len(run)} segments into {path}")
+            else:
+                merged.extend(run)
+            run = [segment] if segment is not None else []
+        self.segments = merged
+
+    def aggregate(
+        self,
+        group_by: Sequence[str] = (),
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        hosts: Optional[Iterable[str]] = None,
+        programs: Optional[Iterable[str]] = None,
+        severity: Optional[str] = None,
+        contains: Optional[str] = None,
+    ) -> Counter:
+        """Count matching lines per distinct value of the group_by columns.
+
+        group_by names come from GROUP_COLUMNS; minute, hour and day bucket
+        the timestamp. severity keeps lines at that level or more severe and
+        contains is a case-insensitive substring of the message.
+        """
+        for name in group_by:
+            if name not in GROUP_COLUMNS:
+                raise ValueError(
+                    f"Cannot group by {name!r}, expected one of {GROUP_COLUMNS}"
+                )
+        hosts = set(hosts) if hosts else None
+        programs = set(programs) if programs else None
+        counts = Counter()
+        for segment in self.segments:
+            if not segment.overlaps(start, end):
+                continue
+            mask = segment.mask(start, end, hosts, programs, severity, contains)
+            if not group_by:
+                counts[()] += int(mask.sum())
+                continue
+            if not mask.any():
+                continue
+            keys = np.stack([segment.key(name, mask) for name in group_by], 1)
+            unique, sizes = np.unique(keys, axis=0, return_counts=True)
+            for row, size in zip(unique.tolist(), sizes.tolist()):
+                key = tuple(
+                    segment.decode(name, value) for name, value in zip(group_by, row)
+                )
+                counts[key] += size
+        return counts
+
+
+def format_table(counts: Counter, group_by: Sequence[str], limit: int = 50) -> str:
+    """Render aggregate counts as a compact tab separated table.
+
+    Groups are ordered by time if group_by has a time bucket, otherwise by
+    count, largest first. Only the first limit groups are shown.
+    """
+    if any(name in TIME_BUCKETS for name in group_by):
+        rows = sorted(counts.items())
+    else:
+        rows = counts.most_common()
+    total = sum(counts.values())
+    lines = ["\t".join([*group_by, "count"])]
+    lines += ["\t".join([*key, str(count)]) for key, count in rows[:limit]]
+    if len(rows) > limit:
+        lines.append(f"... {len(rows) - limit} more groups")
+    lines.append(f"{len(rows)} groups, {total} lines")
+    return "\n".join(lines)
+
+
+@functools.cache
+def default_store() -> LogStore:
+    return LogStore(STORE_PATH)
@@ -0,0 +1,42 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class IngestManifest:
+    """Remembers how far into each log file ingest has progressed.
+
+    Entries are keyed by absolute path and hold the inode, size and mtime seen
+    on the last run, the byte offset ingested up to, a hash of the bytes just
+    before that offset and a generation counter that is bumped whenever the
+    file is rotated or truncated.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+            logger.info(f"Loaded ingest manifest {path} with {len(self.entries)} files")
+
+    @staticmethod
+    def key(file_path: str) -> str:
+        return os.path.abspath(file_path)
+
+    def get(self, file_path: str):
+        return self.entries.get(self.key(file_path))
+
+    def update(self, file_path: str, **entry) -> None:
+        self.entries[self.key(file_path)] = entry
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,115 @@
+from langchain_core.output_parsers import StrOutputParser
+from logs_langchain import chunking, prompts
+from typing import Iterable, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def segments(lines: Iterable[str], max_tokens: int):
+    """Group lines into (line_start, line_end, text) segments of at most max_tokens.
+
+    Lines are never split; a single line longer than max_tokens becomes a
+    segment of its own.
+    """
+    segment, tokens = [], 0
+    line_start = 1
+    line_no = 0
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        line_tokens = chunking.estimate_tokens(line)
+        if segment and tokens + line_tokens > max_tokens:
+            yield line_start, line_no - 1, "\n".join(segment)
+            segment, tokens = [], 0
+            line_start = line_no
+        segment.append(line)
+        tokens += line_tokens
+    if segment:
+        yield line_start, line_no, "\n".join(segment)
+
+
+class LogMapReduce:
+    """Answers a question over a whole log, however long.
+
+    The log is cut into segments of segment_tokens and the map prompt is run
+    on all of them concurrently, at most max_concurrency at a time. Segments
+    with nothing relevant are dropped and the remaining notes are reduced
+    fan_in at a time, level by level, until one answer is left. Wall time
+    grows with the number of rounds, not with the size of the log, as long
+    as there are workers to spare.
+    """
+
+    def __init__(
+        self,
+        llm,
+        segment_tokens: int = 8000,
+        max_concurrency: int = 8,
+        fan_in: int = 8,
+    ) -> None:
+        self.segment_tokens = segment_tokens
+        self.max_concurrency = max_concurrency
+        self.fan_in = fan_in
+        parser = StrOutputParser()
+        self.answer_chain = prompts.sysadmin_log_context_answer | llm | parser
+        self.map_chain = prompts.log_segment_map | llm | parser
+        self.reduce_chain = prompts.log_segment_reduce | llm | parser
+
+    @property
+    def config(self):
+        return {"max_concurrency": self.max_concurrency}
+
+    def map(self, question: str, parts) -> List[str]:
+        inputs = [
+            {
+                "question": question,
+                "part": f"{i} of {len(parts)}",
+                "line_start": line_start,
+                "line_end": line_end,
+                "logs": text,
+            }
+            for i, (line_start, line_end, text) in enumerate(parts, 1)
+        ]
+        notes = self.map_chain.batch(inputs, config=self.config)
+        relevant = [
+            f"Lines {line_start}-{line_end}:\n{note.strip()}"
+            for (line_start, line_end, _), note in zip(parts, notes)
+            if prompts.NOTHING_RELEVANT not in note
+        ]
+        logger.info(f"{len(relevant)} of {len(parts)} log segments are relevant")
+        return relevant
+
+    def reduce(self, question: str, notes: List[str]) -> str:
+        level = 0
+        while len(notes) > 1:
+            groups = [
+                notes[i : i + self.fan_in] for i in range(0, len(notes), self.fan_in)
+            ]
+            notes = self.reduce_chain.batch(
+                [
+                    {"question": question, "notes": "\n\n".join(group)}
+                    for group in groups
+                ],
+                config=self.config,
+            )
+            level += 1
+            logger.debug(f"Reduce level {level} left {len(notes)} notes")
+        return notes[0]
+
+    def answer(self, question: str, lines: Iterable[str]) -> str:
+        parts = list(segments(lines, self.segment_tokens))
+        if not parts:
+            return "I don't know"
+        if len(parts) == 1:
+            return self.answer_chain.invoke({"question": question, "logs": parts[0][2]})
+        logger.info(f"Mapping {len(parts)} log segments")
+        notes = self.map(question, parts)
+        if not notes:
+            return "I don't know"
+        if len(notes) == 1:
+            # Still phrase a single note as an answer to the question.
+            return self.reduce_chain.invoke({"question": question, "notes": notes[0]})
+        return self.reduce(question, notes)
+
+    def answer_file(self, question: str, path: str) -> str:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return self.answer(question, f)
@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from typing import Dict, List, Optional
+import hashlib
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "lograg"
+UNKNOWN_HOST = "unknown"
+UNDATED = "undated"
+
+
+def bucket_range(ts: float, bucket: str = "day"):
+    """Return (label, start, end) of the day or week bucket holding ts."""
+    day = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        start, length = day, timedelta(days=1)
+    elif bucket == "week":
+        start, length = day - timedelta(days=day.weekday()), timedelta(weeks=1)
+    else:
+        raise ValueError(f"Unknown bucket {bucket!r}, expected 'day' or 'week'")
+    return start.strftime("%Y%m%d"), start.timestamp(), (start + length).timestamp()
+
+
+def collection_name(host: str, label: str) -> str:
+    # Chroma names are 3-63 characters of [a-zA-Z0-9._-], alphanumeric at
+    # both ends. The real host is kept in the collection metadata, and a hash
+    # of it keeps hosts that sanitise to the same text apart.
+    digest = hashlib.sha256(host.encode("utf-8")).hexdigest()[:8]
+    host = re.sub(r"[^a-zA-Z0-9_-]+", "-", host).strip("-_")[:32] or UNKNOWN_HOST
+    return f"{PREFIX}_{host}_{digest}_{label}"
+
+
+def filter_bounds(where: Optional[dict]):
+    """Pull (start, end, hosts) out of a where clause from scope.metadata_filter."""
+    start = end = hosts = None
+    if not where:
+        return start, end, hosts
+    for clause in where.get("$and", [where]):
+        for key, condition in clause.items():
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            if key == "ts_end" and "$gte" in condition:
+                start = condition["$gte"]
+            elif key == "ts_start" and "$lte" in condition:
+                end = condition["$lte"]
+            elif key == "host" and "$in" in condition:
+                hosts = set(condition["$in"])
+            elif key == "host" and "$eq" in condition:
+                hosts = {condition["$eq"]}
+    return start, end, hosts
+
+
+class Partition:
+    def __init__(self, store, name: str, metadata: dict) -> None:
+        self.store = store
+        self.name = name
+        self.metadata = metadata
+
+    def overlaps(self, start, end, hosts) -> bool:
+        md = self.metadata
+        if hosts is not None and md["host"] not in hosts:
+            return False
+        if start is None and end is None:
+            return True
+        if md["bucket"] == UNDATED:
+            # Chunks without timestamps never match a time filter.
+            return False
+        # A chunk belongs to the bucket of its ts_start but may end in a later
+        # one, so the end is the latest ts_end added, if past the bucket.
+        return (start is None or max(md["end"], md.get("ts_end", 0)) >= start) and (
+            end is None or md["start"] <= end
+        )
+
+    def extend(self, documents: List[Document]) -> None:
+        """Record in the collection metadata how far past the bucket documents run."""
+        ts_end = max((doc.metadata.get("ts_end", 0) for doc in documents), default=0)
+        if ts_end <= max(self.metadata["end"], self.metadata.get("ts_end", 0)):
+            return
+        self.metadata = {**self.metadata, "ts_end": ts_end}
+        self.store._collection.modify(metadata=self.metadata)
+
+
+class PartitionedVectorStore:
+    """Chroma collections sharded by host and day (or week).
+
+    Documents go to the collection for their host and the bucket holding
+    their ts_start. A query embeds the question once, searches only the
+    partitions its filter can match, concurrently, and merges the top k by
+    distance. Retention is a matter of dropping whole partitions.
+
+    Implements the parts of the vector store interface used by ingest and
+    lograg: add_documents, get, similarity_search.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        client,
+        bucket: str = "day",
+        max_workers: int = 8,
+    ) -> None:
+        self.embeddings = embeddings
+        self.client = client
+        self.bucket = bucket
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.partitions: Dict[str, Partition] = {}
+        for collection in client.list_collections():
+            name = getattr(collection, "name", collection)
+            if not name.startswith(f"{PREFIX}_"):
+                continue
+            metadata = client.get_collection(name).metadata or {}
+            if "host" in metadata:
+                self.partitions[name] = self._open(name, metadata)
+        logger.info(f"Opened {len(self.partitions)} vector store partitions")
+
+    def _open(self, name: str, metadata: dict) -> Partition:
+        from langchain_chroma import Chroma
+
+        store = Chroma(
+            client=self.client,
+            collection_name=name,
+            embedding_function=self.embeddings,
+            collection_metadata=metadata,
+        )
+        return Partition(store, name, metadata)
+
+    def partition_for(self, metadata: dict) -> Partition:
+        host = metadata.get("host") or UNKNOWN_HOST
+        if "ts_start" in metadata:
+            label, start, end = bucket_range(metadata["ts_start"], self.bucket)
+        else:
+            label, start, end = UNDATED, 0.0, 0.0
+        name = collection_name(host, label)
+        with self.lock:
+            if name not in self.partitions:
+                md = {"host": host, "bucket": label, "start": start, "end": end}
+                self.partitions[name] = self._open(name, md)
+                logger.debug(f"Created partition {name}")
+            return self.partitions[name]
+
+    def add_documents(self, documents: List[Document], **kwargs) -> List[str]:
+        groups: Dict[str, List[Document]] = {}
+        for doc in documents:
+            groups.setdefault(self.partition_for(doc.metadata).name, []).append(doc)
+        with self.lock:
+            for name, docs in groups.items():
+                self.partitions[name].extend(docs)
+        futures = [
+            self.executor.submit(
+                self.partitions[name].store.add_documents, docs, **kwargs
+            )
+            for name, docs in groups.items()
+        ]
+        return [doc_id for future in futures for doc_id in future.result()]
+
+    def select(self, where: Optional[dict] = None) -> List[Partition]:
+        start, end, hosts = filter_bounds(where)
+        return [
+            partition
+            for partition in list(self.partitions.values())
+            if partition.overlaps(start, end, hosts)
+        ]
+
+    def get(self, where=None, include=None, limit=None, **kwargs):
+        """Like Chroma.get, across the partitions where can match."""
+        results = {"ids": [], "metadatas": [], "documents": []}
+        for partition in self.select(where):
+            remaining = None if limit is None else limit - len(results["ids"])
+            if remaining is not None and remaining <= 0:
+                break
+            found = partition.store.get(
+                where=where, include=include, limit=remaining, **kwargs
+            )
+            for key in results:
+                results[key].extend(found.get(key) or [])
+        return results
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[dict] = None
+    ):
+        partitions = self.select(filter)
+        if not partitions:
+            return []
+        vector = self.embeddings.embed_query(query)
+        started = time.monotonic()
+        futures = [
+            self.executor.submit(
+                partition.store.similarity_search_by_vector_with_relevance_scores,
+                vector,
+                k,
+                filter,
+            )
+            for partition in partitions
+        ]
+        hits = [hit for future in futures for hit in future.result()]
+        logger.debug(
+            f"Searched {len(partitions)} of {len(self.partitions)} partitions in {time.monotonic() - started:.3f}s"
+        )
+        # Chroma scores are distances: smaller is closer.
+        return sorted(hits, key=lambda hit: hit[1])[:k]
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def drop_partition(self, name: str) -> None:
+        with self.lock:
+            self.partitions.pop(name, None)
+        self.client.delete_collection(name)
+        logger.info(f"Dropped partition {name}")
+
+    def drop_older_than(self, ts: float) -> List[str]:
+        """Retention: drop every dated partition that ends before ts."""
+        dropped = [
+            name
+            for name, partition in list(self.partitions.items())
+            if partition.metadata["bucket"] != UNDATED
+            and partition.metadata["end"] <= ts
+        ]
+        for name in dropped:
+            self.drop_partition(name)
+        return dropped
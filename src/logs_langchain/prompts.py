@@ -141,3 +141,37 @@ dangerous_command_verification = ChatPromptTemplate.from_messages(
         ("user", "Command: {command}"),
     ]
 )
+
+
+# Map-reduce over a whole log file, see mapreduce.LogMapReduce.
+NOTHING_RELEVANT = "NOTHING RELEVANT"
+
+log_segment_map = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """
+            You are a helpful sysadmin reading one part of a larger log file. Use only the log lines provided to note everything that helps answer the user's question. Quote the supporting log lines with their timestamps. Be brief: your notes will be combined with notes on the other parts of the file.
+            If these lines contain nothing relevant to the question, reply with exactly: """
+            + NOTHING_RELEVANT
+            + """
+            """,
+        ),
+        (
+            "user",
+            "User's Question: {question}\n\nLog part {part} (lines {line_start}-{line_end}):\n{logs}",
+        ),
+    ]
+)
+
+log_segment_reduce = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """
+            You are a helpful sysadmin. Below are notes taken on consecutive parts of a log file, in order. Combine them into a single answer to the user's question. Keep the quoted log lines that support the answer, keep events in chronological order and drop repeated information. If the notes do not answer the question, respond with 'I don't know'.
+            """,
+        ),
+        ("user", "User's Question: {question}\n\nNotes:\n{notes}"),
+    ]
+)
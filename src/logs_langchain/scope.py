@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+import re
+
+UNITS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+WORD_NUMBERS = {
+    "a": 1,
+    "an": 1,
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "ten": 10,
+    "twelve": 12,
+    "few": 3,
+}
+LAST_N = re.compile(
+    r"\b(?:last|past|previous)\s+(?:(\d+|[a-z]+)\s+)?(minute|hour|day|week)s?\b",
+    re.IGNORECASE,
+)
+ISO_DATE = re.compile(r"\b(\d{4}-\d\d-\d\d)\b")
+# Questions about frequency or recurring messages are best answered by
+# templates.TemplateChunker documents, which carry occurrence counts.
+TEMPLATE_QUESTION = re.compile(
+    r"\bhow (?:often|many times|frequently)\b|\b(?:frequen\w*|recurring|repeated\w*"
+    r"|most common|pattern\w*|templates?)\b",
+    re.IGNORECASE,
+)
+
+
+def extract_time_range(question: str, now: Optional[datetime] = None):
+    """Return (start, end) epoch seconds for a time phrase in question, or (None, None)."""
+    now = now or datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    text = question.lower()
+
+    if "last night" in text or "overnight" in text:
+        start, end = midnight - timedelta(hours=6), midnight + timedelta(hours=8)
+    elif "yesterday" in text:
+        start, end = midnight - timedelta(days=1), midnight
+    elif "this morning" in text:
+        start, end = midnight, midnight + timedelta(hours=12)
+    elif "today" in text:
+        start, end = midnight, now
+    else:
+        match = LAST_N.search(text)
+        date = ISO_DATE.search(text)
+        if match:
+            count = match.group(1) or "1"
+            count = int(count) if count.isdigit() else WORD_NUMBERS.get(count)
+            if count is None:
+                return None, None
+            start, end = now - count * UNITS[match.group(2).lower()], now
+        elif date:
+            try:
+                start = datetime.fromisoformat(date.group(1))
+            except ValueError:
+                return None, None
+            end = start + timedelta(days=1)
+        else:
+            return None, None
+    return start.timestamp(), min(end, now).timestamp()
+
+
+def extract_hosts(question: str, known_hosts: Iterable[str]) -> Optional[List[str]]:
+    found = [
+        host
+        for host in known_hosts
+        if re.search(rf"(?<![\w-]){re.escape(host)}(?![\w-])", question, re.IGNORECASE)
+    ]
+    return found or None
+
+
+def extract_kind(question: str) -> Optional[str]:
+    """Return "template" for questions about how often things happen, else None."""
+    return "template" if TEMPLATE_QUESTION.search(question) else None
+
+
+def metadata_filter(
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    hosts: Optional[List[str]] = None,
+    kind: Optional[str] = None,
+) -> Optional[dict]:
+    """Build a Chroma where clause selecting chunks that overlap [start, end] on hosts."""
+    clauses = []
+    if start is not None:
+        clauses.append({"ts_end": {"$gte": start}})
+    if end is not None:
+        clauses.append({"ts_start": {"$lte": end}})
+    if hosts:
+        clauses.append({"host": {"$in": list(hosts)}})
+    if kind:
+        clauses.append({"kind": kind})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def matches(metadata: dict, where: dict) -> bool:
+    """Evaluate a where clause built by metadata_filter against one metadata dict."""
+    if "$and" in where:
+        return all(matches(metadata, clause) for clause in where["$and"])
+    if "$or" in where:
+        return any(matches(metadata, clause) for clause in where["$or"])
+    for key, condition in where.items():
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            if value is None:
+                return False
+            if op == "$eq" and not value == operand:
+                return False
+            if op == "$ne" and not value != operand:
+                return False
+            if op == "$gte" and not value >= operand:
+                return False
+            if op == "$gt" and not value > operand:
+                return False
+            if op == "$lte" and not value <= operand:
+                return False
+            if op == "$lt" and not value < operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$nin" and value in operand:
+                return False
+    return True
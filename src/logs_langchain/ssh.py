@@ -1,10 +1,21 @@
-from fabric import Connection
+import json
 import logging
 import os
-from typing import Optional, Any
+import shlex
+import zlib
+from typing import TYPE_CHECKING, Optional, Any
+
+# fabric pulls in paramiko and cryptography; import it only to connect.
+if TYPE_CHECKING:
+    from fabric import Connection
 
 logger = logging.getLogger(__name__)
 
+SYNC_BLOCK_SIZE = 1024 * 1024
+# Bytes at the end of the local copy compared against the remote file to make
+# sure it is still the same file before appending to it.
+SYNC_CHECK_BYTES = 4096
+
 
 class SSHClient:
     def __init__(
@@ -13,19 +24,25 @@ class SSHClient:
         user: str,
         key_filename: str,
         logger: Optional[logging.Logger] = None,
+        connection: Optional["Connection"] = None,
     ) -> None:
         self.host = host
         self.user = user
         self.key_filename = key_filename
         self.logger = logger or logging.getLogger(__name__)
-        self.connection: Optional[Connection] = None
+        # A connection passed in (e.g. from sshpool) is borrowed, not closed.
+        self.connection: Optional["Connection"] = connection
+        self.owns_connection = connection is None
 
     def __enter__(self) -> "SSHClient":
-        self.connection = Connection(
-            host=self.host,
-            user=self.user,
-            connect_kwargs={"key_filename": self.key_filename},
-        )
+        if self.connection is None:
+            from fabric import Connection
+
+            self.connection = Connection(
+                host=self.host,
+                user=self.user,
+                connect_kwargs={"key_filename": self.key_filename},
+            )
         return self
 
     def __exit__(
@@ -34,11 +51,10 @@ class SSHClient:
         exc_val: Optional[BaseException],
         exc_tb: Optional[Any],
     ) -> None:
-        if self.connection:
-            self.connection.close()
+        self.close()
 
-    def run_command(self, command: str) -> str:
-        result = self.connection.run(command, hide=True)
+    def run_command(self, command: str, timeout: Optional[int] = None) -> str:
+        result = self.connection.run(command, hide=True, timeout=timeout)
         return result.stdout.strip()
 
     def download(self, remote: str, local: str, output: Optional[str] = None) -> None:
@@ -50,8 +66,149 @@ class SSHClient:
         file_size = os.path.getsize(local)
         self.logger.info("Downloaded %s to %s (size: %s)", remote, local, file_size)
 
+    def remote_stat(self, remote: str):
+        output = self.run_command(f"stat -L -c '%i %s' {shlex.quote(remote)}")
+        inode, size = output.split()
+        return int(inode), int(size)
+
+    def sync(self, remote: str, local: str) -> int:
+        """Bring local up to date with remote, transferring only appended bytes.
+
+        The remote inode is remembered in a sidecar file next to local. As long
+        as the inode is unchanged, the remote has not shrunk and the end of the
+        local copy still matches the remote, only the bytes after the local
+        copy are fetched. That also resumes an interrupted transfer. Otherwise
+        (rotation, truncation) the whole file is copied again. Returns the
+        number of bytes transferred.
+        """
+        state_path = f"{local}.sync.json"
+        inode, remote_size = self.remote_stat(remote)
+        state = None
+        local_size = 0
+        if os.path.exists(local):
+            local_size = os.path.getsize(local)
+            if os.path.exists(state_path):
+                with open(state_path, "r") as f:
+                    state = json.load(f)
+        elif os.path.exists(state_path):
+            # The copy it describes is gone, so download the whole file.
+            os.remove(state_path)
+
+        sftp = self.connection.sftp()
+        with sftp.open(remote, "rb") as remote_file:
+            offset = 0
+            if (
+                state is not None
+                and state["host"] == self.host
+                and state["remote"] == remote
+                and state["inode"] == inode
+                and local_size <= remote_size
+            ):
+                check = min(local_size, SYNC_CHECK_BYTES)
+                remote_file.seek(local_size - check)
+                with open(local, "rb") as local_file:
+                    local_file.seek(local_size - check)
+                    if remote_file.read(check) == local_file.read(check):
+                        offset = local_size
+            if offset == 0:
+                self.logger.info(f"Copying all of {self.host}:{remote} to {local}")
+            else:
+                self.logger.info(
+                    f"Fetching {self.host}:{remote} from byte {offset} to {remote_size}"
+                )
+
+            directory = os.path.dirname(local)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            state = {"host": self.host, "remote": remote, "inode": inode}
+            with open(state_path, "w") as f:
+                json.dump(state, f)
+
+            remote_file.seek(offset)
+            # prefetch reads ahead from the current position up to file_size,
+            # which is the end offset, not a length.
+            remote_file.prefetch(remote_size)
+            transferred = 0
+            with open(local, "r+b" if offset else "wb") as local_file:
+                local_file.seek(offset)
+                local_file.truncate()
+                while offset + transferred < remote_size:
+                    block = remote_file.read(
+                        min(SYNC_BLOCK_SIZE, remote_size - offset - transferred)
+                    )
+                    if not block:
+                        break
+                    local_file.write(block)
+                    transferred += len(block)
+
+        self.logger.info(
+            f"Synced {self.host}:{remote} to {local} ({transferred} bytes transferred, size: {offset + transferred})"
+        )
+        return transferred
+
+    def stream(
+        self,
+        remote: str,
+        compression: Optional[str] = "gzip",
+        offset: int = 0,
+        block_size: int = SYNC_BLOCK_SIZE,
+    ):
+        """Yield the decompressed bytes of remote, compressed on the remote side.
+
+        The file is piped through gzip or zstd over an exec channel and
+        decompressed block by block as it arrives, so nothing is written to
+        local disk and the file is never held in memory. Pass offset to start
+        part way through the file. Feed the result to ingest.ingest_stream.
+        """
+        path = shlex.quote(remote)
+        command = f"test -r {path} && tail -c +{offset + 1} {path}"
+        match compression:
+            case "gzip":
+                command += " | gzip -c -1"
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            case "zstd":
+                try:
+                    import zstandard
+                except ImportError as e:
+                    raise ImportError(
+                        "zstd streaming needs the zstandard package installed"
+                    ) from e
+                command += " | zstd -c -1 -q"
+                decompressor = zstandard.ZstdDecompressor().decompressobj()
+            case None:
+                decompressor = None
+            case _:
+                raise ValueError(f"Unsupported compression {compression}")
+
+        self.connection.open()
+        channel = self.connection.transport.open_session()
+        try:
+            channel.exec_command(command)
+            received = 0
+            while block := channel.recv(block_size):
+                received += len(block)
+                if decompressor is not None:
+                    block = decompressor.decompress(block)
+                if block:
+                    yield block
+            if decompressor is not None and hasattr(decompressor, "flush"):
+                tail = decompressor.flush()
+                if tail:
+                    yield tail
+            status = channel.recv_exit_status()
+            if status != 0:
+                error = channel.recv_stderr(4096).decode("utf-8", errors="replace")
+                raise RuntimeError(
+                    f"Streaming {self.host}:{remote} failed with status {status}: {error}"
+                )
+            self.logger.info(
+                f"Streamed {self.host}:{remote} ({received} bytes on the wire)"
+            )
+        finally:
+            channel.close()
+
     def close(self) -> None:
-        if self.connection:
+        if self.connection and self.owns_connection:
             self.connection.close()
 
 
@@ -0,0 +1,264 @@
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from logs_langchain import hosts, ssh
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+import atexit
+import logging
+import math
+import threading
+import time
+
+if TYPE_CHECKING:
+    from fabric import Connection
+
+logger = logging.getLogger(__name__)
+
+# Seconds run_many waits past a host's timeout for the remote side to give up.
+REMOTE_TIMEOUT_GRACE = 5
+
+
+class PooledConnection:
+    def __init__(self, host: str, connection) -> None:
+        self.host = host
+        self.connection = connection
+        self.in_use = 0
+        self.broken = False
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """Process-wide pool of long-lived SSH connections, keyed by hosts.HOSTS name.
+
+    Each connection serves up to channels_per_connection commands at once as
+    separate channels over the same transport, and at most
+    max_connections_per_host connections are opened to a host. Connections
+    idle for longer than idle_timeout are closed; the rest are kept alive with
+    SSH keepalives and checked before reuse. A background thread sweeps all
+    hosts every sweep_interval seconds, so connections to hosts that are not
+    used again are closed too.
+    """
+
+    def __init__(
+        self,
+        connect: Optional[Callable[[str], object]] = None,
+        max_connections_per_host: int = 2,
+        channels_per_connection: int = 4,
+        idle_timeout: float = 300,
+        keepalive: int = 30,
+        connect_timeout: float = 10,
+        sweep_interval: Optional[float] = None,
+    ) -> None:
+        self.connect = connect or self.fabric_connect
+        self.max_connections_per_host = max_connections_per_host
+        self.channels_per_connection = channels_per_connection
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.sweep_interval = sweep_interval or idle_timeout / 2
+        self.connections = defaultdict(list)
+        self.opening = defaultdict(int)
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.reaper: Optional[threading.Thread] = None
+
+    def fabric_connect(self, host: str) -> "Connection":
+        from fabric import Connection
+
+        host_info = hosts.HOSTS[host]
+        connection = Connection(
+            host=host,
+            user=host_info["username"],
+            connect_kwargs={"key_filename": host_info["key_file"]},
+            connect_timeout=self.connect_timeout,
+        )
+        connection.open()
+        connection.transport.set_keepalive(self.keepalive)
+        logger.info(f"Opened SSH connection to {host}")
+        return connection
+
+    @staticmethod
+    def healthy(connection) -> bool:
+        transport = getattr(connection, "transport", None)
+        if transport is not None and not transport.is_active():
+            return False
+        return connection.is_connected
+
+    def _close(self, pooled: PooledConnection) -> None:
+        try:
+            pooled.connection.close()
+        except Exception as e:
+            logger.debug(f"Error closing connection to {pooled.host}: {e}")
+
+    def _prune(self, host: str) -> None:
+        now = time.monotonic()
+        for pooled in list(self.connections[host]):
+            if pooled.in_use:
+                continue
+            if (
+                pooled.broken
+                or now - pooled.last_used > self.idle_timeout
+                or not self.healthy(pooled.connection)
+            ):
+                self.connections[host].remove(pooled)
+                self._close(pooled)
+                logger.debug(f"Evicted SSH connection to {host}")
+
+    def sweep(self) -> None:
+        """Close idle and broken connections to every host."""
+        with self.condition:
+            for host in list(self.connections):
+                self._prune(host)
+                if not self.connections[host] and not self.opening.get(host):
+                    del self.connections[host]
+
+    def _reap(self) -> None:
+        while not self.stopped.wait(self.sweep_interval):
+            self.sweep()
+
+    def acquire(self, host: str, timeout: Optional[float] = None) -> PooledConnection:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            # Started on first use, so importing the module starts no thread.
+            if self.reaper is None:
+                self.reaper = threading.Thread(
+                    target=self._reap, name="sshpool-reaper", daemon=True
+                )
+                self.reaper.start()
+            while True:
+                self._prune(host)
+                available = [
+                    pooled
+                    for pooled in self.connections[host]
+                    if pooled.in_use < self.channels_per_connection
+                ]
+                if available:
+                    pooled = min(available, key=lambda pooled: pooled.in_use)
+                    pooled.in_use += 1
+                    return pooled
+                opened = len(self.connections[host]) + self.opening[host]
+                if opened < self.max_connections_per_host:
+                    self.opening[host] += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No SSH connection to {host} became available")
+                self.condition.wait(remaining)
+
+        # Connect outside the lock so other hosts are not blocked by a handshake.
+        try:
+            connection = self.connect(host)
+        except Exception:
+            with self.condition:
+                self.opening[host] -= 1
+                self.condition.notify_all()
+            raise
+        pooled = PooledConnection(host, connection)
+        pooled.in_use = 1
+        with self.condition:
+            self.opening[host] -= 1
+            self.connections[host].append(pooled)
+        return pooled
+
+    def release(self, pooled: PooledConnection, broken: bool = False) -> None:
+        with self.condition:
+            pooled.in_use -= 1
+            pooled.last_used = time.monotonic()
+            pooled.broken = pooled.broken or broken
+            self._prune(pooled.host)
+            self.condition.notify_all()
+
+    @contextmanager
+    def client(self, host: str, timeout: Optional[float] = None):
+        """Yield an ssh.SSHClient running over a pooled connection to host."""
+        pooled = self.acquire(host, timeout)
+        broken = False
+        try:
+            yield ssh.SSHClient(host, None, None, connection=pooled.connection)
+        except Exception:
+            broken = not self.healthy(pooled.connection)
+            raise
+        finally:
+            self.release(pooled, broken)
+
+    def run_many(
+        self,
+        host_names: List[str],
+        command: str,
+        timeout: float = 30,
+        max_workers: int = 8,
+    ) -> Dict[str, Tuple[bool, str]]:
+        """Run command on every host concurrently.
+
+        Returns {host: (succeeded, output or error)} in the order given. Each
+        host gets timeout seconds from when its turn starts; a host that does
+        not answer in time is reported as failed without holding up the
+        others.
+        """
+        started = {}
+
+        def run(host):
+            started[host] = time.monotonic()
+            with self.client(host, timeout=timeout) as client:
+                return client.run_command(command, timeout=int(timeout))
+
+        workers = min(max_workers, len(host_names)) or 1
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {host: executor.submit(run, host) for host in host_names}
+        # Give the remote timeout a moment to fire before giving up locally.
+        limit = timeout + REMOTE_TIMEOUT_GRACE
+        # Queued hosts wait for a free worker, but never longer than it
+        # takes every wave of hosts to time out.
+        give_up = time.monotonic() + limit * math.ceil(len(host_names) / workers)
+        pending = set(futures.values())
+        while pending:
+            now = time.monotonic()
+            deadlines = {
+                future: started[host] + limit
+                for host, future in futures.items()
+                if future in pending and host in started
+            }
+            active = {
+                future
+                for future in pending
+                if future not in deadlines or deadlines[future] > now
+            }
+            if not active or now >= give_up:
+                break
+            # Hosts already reported as timed out are not waited for again.
+            next_deadline = min(
+                [give_up, *(deadlines[f] for f in active if f in deadlines)]
+            )
+            if any(future not in deadlines for future in active):
+                # Look again soon for hosts that start once a worker frees up.
+                next_deadline = min(next_deadline, now + 1)
+            done, _ = wait(
+                active, timeout=max(0, next_deadline - now), return_when=FIRST_COMPLETED
+            )
+            pending -= done
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        results = {}
+        for host, future in futures.items():
+            if future.cancelled():
+                results[host] = (False, "cancelled before it started")
+            elif not future.done():
+                results[host] = (False, f"timed out after {timeout}s")
+            elif future.exception() is not None:
+                error = future.exception()
+                results[host] = (False, f"{type(error).__name__}: {error}")
+            else:
+                results[host] = (True, future.result())
+        return results
+
+    def close_all(self) -> None:
+        self.stopped.set()
+        with self.condition:
+            for host, connections in self.connections.items():
+                for pooled in connections:
+                    self._close(pooled)
+            self.connections.clear()
+
+
+pool = ConnectionPool()
+atexit.register(pool.close_all)
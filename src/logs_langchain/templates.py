@@ -0,0 +1,200 @@
+from langchain_core.documents import Document
+from logs_langchain import logparse
+from typing import Dict, List, Optional
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "<*>"
+# Tokens containing digits (PIDs, ports, IPs, durations, ids) are variables
+# almost always, so they are never allowed to split templates.
+VARIABLE = re.compile(r"\d")
+# Distinct values kept per parameter slot of a template document.
+PARAM_SAMPLES = 5
+
+
+class Template:
+    def __init__(self, template_id: int, tokens: List[str]) -> None:
+        self.id = template_id
+        self.tokens = tokens
+        self.size = 0
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.tokens)
+
+
+class TemplateMiner:
+    """Online log template mining with the Drain fixed-depth parse tree.
+
+    Lines are routed by token count and then by their first depth - 2 tokens
+    to a leaf holding a few candidate templates. A line joins the most similar
+    candidate if at least similarity of its tokens match, turning the tokens
+    that differ into wildcards, and starts a new template otherwise.
+    """
+
+    def __init__(
+        self, depth: int = 4, similarity: float = 0.4, max_children: int = 100
+    ) -> None:
+        self.depth = depth
+        self.similarity = similarity
+        self.max_children = max_children
+        self.root: Dict = {}
+        self.templates: List[Template] = []
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return [WILDCARD if VARIABLE.search(token) else token for token in text.split()]
+
+    def leaf(self, tokens: List[str]) -> List[Template]:
+        node = self.root.setdefault(len(tokens), {})
+        for token in tokens[: self.depth - 2]:
+            if token not in node and len(node) >= self.max_children:
+                token = WILDCARD
+            node = node.setdefault(token, {})
+        return node.setdefault(None, [])
+
+    @staticmethod
+    def score(template: Template, tokens: List[str]):
+        same = params = 0
+        for template_token, token in zip(template.tokens, tokens):
+            if template_token == WILDCARD:
+                params += 1
+            elif template_token == token:
+                same += 1
+        return same / len(tokens), params
+
+    def add(self, text: str) -> Template:
+        tokens = self.tokenize(text) or [WILDCARD]
+        candidates = self.leaf(tokens)
+        best, best_score = None, (-1.0, -1)
+        for template in candidates:
+            score = self.score(template, tokens)
+            if score > best_score:
+                best, best_score = template, score
+        if best is None or best_score[0] < self.similarity:
+            best = Template(len(self.templates), tokens)
+            self.templates.append(best)
+            candidates.append(best)
+        else:
+            best.tokens = [
+                template_token if template_token == token else WILDCARD
+                for template_token, token in zip(best.tokens, tokens)
+            ]
+        best.size += 1
+        return best
+
+
+class TemplateGroup:
+    """Occurrences of one template on one host within one time window."""
+
+    def __init__(self, template: Template, line, record) -> None:
+        self.template = template
+        self.first = line
+        self.line_end = line[0]
+        self.count = 0
+        self.timestamps = []
+        self.histogram = dict.fromkeys(logparse.SEVERITIES, 0)
+        # Values seen at each token position. A position may only become a
+        # wildcard later, so all of them are sampled.
+        self.samples: List[List[str]] = []
+        self.host = record.host
+
+    def add(self, line, record, tokens: List[str]) -> None:
+        self.count += 1
+        self.line_end = line[0]
+        if record.ts is not None:
+            self.timestamps.append(record.ts)
+        self.histogram[record.severity] += 1
+        for i, value in enumerate(tokens):
+            if i == len(self.samples):
+                self.samples.append([])
+            if len(self.samples[i]) < PARAM_SAMPLES and value not in self.samples[i]:
+                self.samples[i].append(value)
+
+
+class TemplateChunker:
+    """A chunking.LogChunker alternative that embeds templates, not lines.
+
+    Each line is assigned a template by a TemplateMiner keyed on its program
+    and message. Per window_seconds window and host, every template becomes a
+    single Document holding the template, one example line, the number of
+    occurrences, their time range and samples of the values in each
+    parameter slot. Documents have kind="template" in their metadata.
+    """
+
+    kind = "template"
+
+    def __init__(
+        self, window_seconds: float = 3600, miner: Optional[TemplateMiner] = None
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.miner = miner or TemplateMiner()
+
+    def make_document(self, group: TemplateGroup, metadata) -> Document:
+        template = group.template
+        params = [
+            values
+            for token, values in zip(template.tokens, group.samples)
+            if token == WILDCARD
+        ]
+        md = dict(metadata)
+        md["kind"] = self.kind
+        md["template"] = template.text
+        md["count"] = group.count
+        md["offset"] = group.first[1]
+        md["line_start"] = group.first[0]
+        md["line_end"] = group.line_end
+        if group.timestamps:
+            md["ts_start"] = min(group.timestamps)
+            md["ts_end"] = max(group.timestamps)
+        if group.host:
+            md["host"] = group.host
+        for severity, count in group.histogram.items():
+            md[f"sev_{severity}"] = count
+        # Chroma metadata values must be scalars.
+        md["params"] = json.dumps(params)
+
+        content = [f"Template: {template.text}", f"Occurrences: {group.count}"]
+        if group.timestamps:
+            content[-1] += (
+                f" between {logparse.format_time(md['ts_start'])}"
+                f" and {logparse.format_time(md['ts_end'])}"
+            )
+        if group.host:
+            content[-1] += f" on {group.host}"
+        for i, values in enumerate(params, 1):
+            content.append(f"Parameter {i}: {', '.join(values)}")
+        content.append(f"Example: {group.first[2]}")
+        return Document(page_content="\n".join(content), metadata=md)
+
+    def flush(self, groups, metadata):
+        for group in sorted(groups.values(), key=lambda group: group.first[1]):
+            yield self.make_document(group, metadata)
+        groups.clear()
+
+    def split(self, lines, metadata):
+        """Yield template Documents from an iterable of (line_no, byte_offset, text)."""
+        groups = {}
+        window = None
+        lines_seen = 0
+        for line in lines:
+            record = logparse.parse_line(line[2])
+            if record.ts is not None:
+                line_window = record.ts // self.window_seconds
+                if window is not None and line_window != window:
+                    yield from self.flush(groups, metadata)
+                window = line_window
+            text = f"{record.program or ''} {record.message}"
+            template = self.miner.add(text)
+            key = (record.host, template.id)
+            if key not in groups:
+                groups[key] = TemplateGroup(template, line, record)
+            groups[key].add(line, record, text.split())
+            lines_seen += 1
+        yield from self.flush(groups, metadata)
+        logger.debug(
+            f"Mined {len(self.miner.templates)} templates from {lines_seen} lines"
+        )
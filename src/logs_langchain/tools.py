@@ -1,6 +1,9 @@
 from langchain_core.tools import tool
-from typing import Literal
-from logs_langchain import ssh, hosts
+from typing import Literal, Optional
+from logs_langchain import hosts, logparse, sshpool
+
+# Seconds ssh_command waits for a connection, and then for the command.
+SSH_COMMAND_TIMEOUT = 60
 
 
 def get_user_consent(prompt_message):
@@ -48,9 +51,57 @@ def ping(host) -> bool:
 def ssh_command(host: str, command: str) -> str:
     """Use this to run a command on a remote server via SSH. It returns a string with the command output."""
     # get_user_consent(f"Do you want to run the command '{command}' on {host}?")
-    host_info = hosts.HOSTS[host]
-    with ssh.SSHClient(host, host_info["username"], host_info["key_file"]) as client:
-        return client.run_command(command)
+    with sshpool.pool.client(host, timeout=SSH_COMMAND_TIMEOUT) as client:
+        return client.run_command(command, timeout=SSH_COMMAND_TIMEOUT)
+
+
+@tool
+def ssh_fanout(servers: list[str], command: str, timeout: int = 30) -> str:
+    """Use this to run the same command on several remote servers via SSH at once, for example to check the whole fleet. Pass an empty list of servers to run it on every known server. It returns each server's output tagged with the server name and lists servers that failed or timed out."""
+    servers = servers or list(hosts.HOSTS)
+    results = sshpool.pool.run_many(servers, command, timeout=timeout)
+    sections = []
+    for server, (succeeded, output) in results.items():
+        status = "ok" if succeeded else "failed"
+        sections.append(f"[{server}] ({status})\n{output}")
+    failed = [server for server, (succeeded, _) in results.items() if not succeeded]
+    summary = f"{len(results) - len(failed)} of {len(results)} servers succeeded."
+    if failed:
+        summary += f" Failed: {', '.join(failed)}."
+    return "\n\n".join(sections + [summary])
+
+
+@tool
+def log_aggregate(
+    group_by: list[
+        Literal["host", "program", "severity", "pid", "minute", "hour", "day"]
+    ],
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    servers: Optional[list[str]] = None,
+    programs: Optional[list[str]] = None,
+    min_severity: Optional[
+        Literal["emerg", "alert", "crit", "err", "warning", "notice", "info", "debug"]
+    ] = None,
+    contains: Optional[str] = None,
+    limit: int = 50,
+) -> str:
+    """Use this to count ingested log lines instead of reading them, for example errors per program per hour or which hosts logged the most warnings. Lines can be filtered by an ISO 8601 start and end time, servers, programs (syslog program or systemd unit), a minimum severity (err also counts crit, alert and emerg) and a case-insensitive message substring, then grouped by any of the listed columns; minute, hour and day group by time. Pass an empty group_by for a single total. It returns a table of counts per group."""
+    from logs_langchain import logstore
+
+    try:
+        counts = logstore.default_store().aggregate(
+            group_by,
+            start=logparse.parse_iso(start) if start else None,
+            end=logparse.parse_iso(end) if end else None,
+            hosts=servers,
+            programs=programs,
+            severity=min_severity,
+            contains=contains,
+        )
+    except ValueError as e:
+        return f"Error: {e}"
+    return logstore.format_table(counts, group_by, limit)
 
 
-all = [gen_number, read_local_file, ping, ssh_command]
+all = [gen_number, read_local_file, ping, ssh_command, ssh_fanout, log_aggregate]
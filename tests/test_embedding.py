@@ -0,0 +1,62 @@
+from logs_langchain import embedding
+import pytest
+
+
+def test_scheduler_retries_rate_limited_batches():
+    flaky = embedding.FlakyEmbeddings(
+        size=8, latency=0, rate_limit_probability=0.3, seed=1
+    )
+    scheduler = embedding.EmbeddingScheduler(
+        flaky,
+        batch_size=4,
+        max_workers=2,
+        texts_per_minute=60_000,
+        max_retries=20,
+        base_delay=0,
+    )
+    texts = [f"line {i}" for i in range(40)]
+
+    vectors = scheduler.embed_documents(texts)
+
+    assert vectors == flaky.embeddings.embed_documents(texts)
+    assert scheduler.stats["batches"] == 10
+    assert scheduler.stats["retries"] > 0
+    assert flaky.calls == 10 + scheduler.stats["retries"]
+
+
+def test_scheduler_gives_up_after_max_retries():
+    flaky = embedding.FlakyEmbeddings(size=8, latency=0, rate_limit_probability=1)
+    scheduler = embedding.EmbeddingScheduler(flaky, max_retries=2, base_delay=0)
+
+    with pytest.raises(embedding.RateLimitError):
+        scheduler.embed_query("disk full")
+    assert flaky.calls == 3
+
+
+def test_cache_serves_repeated_texts(tmp_path):
+    flaky = embedding.FlakyEmbeddings(size=8, latency=0, rate_limit_probability=0)
+    cache = embedding.CachedEmbeddings(flaky, str(tmp_path / "cache.sqlite"), "fake")
+
+    first = cache.embed_documents(["a", "b", "a"])
+    second = cache.embed_documents(["b", "a"])
+
+    assert first == [first[0], first[1], first[0]]
+    # Cached vectors come back as float32.
+    assert second[0] == pytest.approx(first[1], rel=1e-6)
+    assert second[1] == pytest.approx(first[0], rel=1e-6)
+    assert flaky.calls == 1
+    # The duplicate "a" in the first call and both texts in the second.
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_cache_keeps_queries_apart_and_persists(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    flaky = embedding.FlakyEmbeddings(size=8, latency=0, rate_limit_probability=0)
+    embedding.CachedEmbeddings(flaky, path, "fake").embed_documents(["a"])
+
+    cache = embedding.CachedEmbeddings(flaky, path, "fake")
+    cache.embed_documents(["a"])
+    cache.embed_query("a")
+
+    assert flaky.calls == 2
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,117 @@
+from logs_langchain import sshpool
+from types import SimpleNamespace
+import pytest
+import threading
+
+
+class FakeConnection:
+    """Stands in for a fabric Connection; run sleeps for the host's delay."""
+
+    def __init__(self, host, delay=0, release=None):
+        self.host = host
+        self.delay = delay
+        self.release = release or threading.Event()
+        self.is_connected = True
+        self.closed = False
+
+    def run(self, command, hide=True, timeout=None):
+        self.release.wait(self.delay)
+        return SimpleNamespace(stdout=f"{self.host}: {command}\n")
+
+    def close(self):
+        self.closed = True
+        self.is_connected = False
+
+
+def test_run_many_times_out_hosts_without_spinning(monkeypatch):
+    monkeypatch.setattr(sshpool, "REMOTE_TIMEOUT_GRACE", 0.5)
+    waits = []
+    real_wait = sshpool.wait
+
+    def counting_wait(*args, **kwargs):
+        waits.append(kwargs.get("timeout"))
+        return real_wait(*args, **kwargs)
+
+    monkeypatch.setattr(sshpool, "wait", counting_wait)
+    release = threading.Event()
+    delays = {"a": 20, "b": 0.1, "c": 3}
+    pool = sshpool.ConnectionPool(
+        connect=lambda host: FakeConnection(host, delays[host], release)
+    )
+    try:
+        results = pool.run_many(["a", "b", "c"], "uptime", timeout=0, max_workers=2)
+    finally:
+        release.set()
+
+    assert results == {
+        "a": (False, "timed out after 0s"),
+        "b": (True, "b: uptime"),
+        "c": (False, "timed out after 0s"),
+    }
+    # Once a has timed out its deadline is in the past; waiting on it again
+    # would return immediately, over and over.
+    assert len(waits) < 10
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect(host):
+        opened.append(FakeConnection(host))
+        return opened[-1]
+
+    return sshpool.ConnectionPool(connect=connect, **kwargs), opened
+
+
+def test_client_reuses_a_connection():
+    pool, opened = make_pool()
+    for _ in range(3):
+        with pool.client("a") as client:
+            assert client.run_command("uptime") == "a: uptime"
+    assert len(opened) == 1
+    pool.close_all()
+    assert opened[0].closed
+
+
+def test_concurrent_clients_share_up_to_channels_per_connection():
+    pool, opened = make_pool(channels_per_connection=2, max_connections_per_host=2)
+    pooled = [pool.acquire("a") for _ in range(4)]
+    assert len(opened) == 2
+    assert {p.in_use for p in pooled} == {2}
+    for p in pooled:
+        pool.release(p)
+    pool.close_all()
+
+
+def test_unhealthy_connection_is_replaced():
+    pool, opened = make_pool()
+    with pool.client("a"):
+        pass
+    opened[0].is_connected = False
+    with pool.client("a"):
+        pass
+    assert len(opened) == 2
+    assert opened[0].closed
+    pool.close_all()
+
+
+def test_sweep_closes_idle_connections_to_every_host(monkeypatch):
+    pool, opened = make_pool(idle_timeout=60)
+    for host in ("a", "b"):
+        with pool.client(host):
+            pass
+    now = sshpool.time.monotonic()
+    monkeypatch.setattr(sshpool.time, "monotonic", lambda: now + 61)
+    pool.sweep()
+    assert all(connection.closed for connection in opened)
+    assert not pool.connections
+    pool.close_all()
+
+
+def test_acquire_times_out_when_host_is_busy():
+    pool, opened = make_pool(channels_per_connection=1, max_connections_per_host=1)
+    held = pool.acquire("a")
+    with pytest.raises(TimeoutError):
+        pool.acquire("a", timeout=0.05)
+    pool.release(held)
+    pool.close_all()